@@ -0,0 +1,206 @@
+#   Copyright (c) 2012 by Jon R. Roma and the Board of Trustees of the
+#   University of Illinois. All rights reserved.
+
+'''
+Measures sdg.directory performance against the in-process LDAP stand-in
+in sdg.fakeldap, seeded with synthetic Campus LDAP entries: connect/bind
+cost, single lookups, batched lookups, and pooled versus unpooled
+throughput. Simulated server latencies make the relative cost of round
+trips visible without access to a campus directory.
+'''
+
+import os
+import sys
+import threading
+import time
+
+from optparse import OptionParser
+
+from sdg import directory
+
+from sdg.fakeldap import FakeDirectory, FakeLDAPObject
+
+_BASE_DN    = 'ou=people,dc=uiuc,dc=edu'
+_BIND_DN    = 'cn=benchmark,dc=uiuc,dc=edu'
+_URI        = 'ldap://fakeldap.invalid'
+
+#####
+
+def _connection(**opt_dict):
+    '''Return Campus LDAP connection to the stand-in directory.'''
+
+    return directory.CampusLDAPConnection(uri=_URI, base_dn=_BASE_DN,
+                                          bind_dn=_BIND_DN, password='x',
+                                          **opt_dict)
+
+#####
+
+def _report(label, count, elapsed, stat_dict=None):
+    '''Print operation rate and mean latency.'''
+
+    print '%-24s %6d in %7.3fs  %9.1f/s  %8.3f ms/op%s' % \
+        (label, count, elapsed, count / elapsed if elapsed else 0.0,
+         1000 * elapsed / count if count else 0.0,
+         '  (%(connect)d connects, %(bind)d binds, %(search)d searches)' %
+            stat_dict if stat_dict else '')
+    return
+
+#####
+
+def _measure(fake_directory, func):
+    '''
+    Call func; return elapsed seconds and operations it caused on the
+    stand-in directory.
+    '''
+
+    before = dict(fake_directory.stat_dict)
+
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+
+    return elapsed, dict((k, v - before[k])
+                            for k, v in fake_directory.stat_dict.items())
+
+#####
+
+def _throughput(opt, **opt_dict):
+    '''
+    Perform open/lookup/close cycles from concurrent threads, as a web
+    application would per request.
+    '''
+
+    remaining   = [ opt.lookups ]
+    lock        = threading.Lock()
+
+    def worker():
+        '''Perform cycles until none remain.'''
+
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                i = remaining[0] = remaining[0] - 1
+
+            with _connection(**opt_dict) as connection:
+                connection.lookup_by_netid('user%06d' % (i % opt.entries))
+
+    thread_list = [ threading.Thread(target=worker)
+                        for i in range(opt.concurrency) ]
+
+    for thread in thread_list:
+        thread.start()
+
+    for thread in thread_list:
+        thread.join()
+
+    return
+
+#####
+
+def main(argv):
+    '''Main function.'''
+
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+
+    opt_parser = OptionParser()
+
+    opt_parser.add_option('--entries', dest='entries', action='store',
+                          type='int', default=10000,
+                          help='number of synthetic directory entries')
+
+    opt_parser.add_option('--lookups', dest='lookups', action='store',
+                          type='int', default=500,
+                          help='number of lookups per measurement')
+
+    opt_parser.add_option('--batch-size', dest='batch_size', action='store',
+                          type='int', default=None,
+                          help='identifiers per filter in batched lookups')
+
+    opt_parser.add_option('--concurrency', dest='concurrency',
+                          action='store', type='int', default=4,
+                          help='number of concurrent threads for throughput')
+
+    opt_parser.add_option('--pool-max', dest='pool_max', action='store',
+                          type='int', default=4,
+                          help='maximum pooled connections for throughput')
+
+    opt_parser.add_option('--connect-ms', dest='connect_ms', action='store',
+                          type='float', default=2.0,
+                          help='simulated connect latency in milliseconds')
+
+    opt_parser.add_option('--bind-ms', dest='bind_ms', action='store',
+                          type='float', default=2.0,
+                          help='simulated bind latency in milliseconds')
+
+    opt_parser.add_option('--search-ms', dest='search_ms', action='store',
+                          type='float', default=1.0,
+                          help='simulated search latency in milliseconds')
+
+    #   Explicit reference to argv is for benefit of unittest.
+    opt, leftover_arg_list = opt_parser.parse_args(argv[1:])
+
+    if len(leftover_arg_list):
+        print >> sys.stderr, opt_parser.get_usage()
+        return 1
+
+    fake_directory = FakeDirectory(connect_delay=opt.connect_ms / 1000.0,
+                                   bind_delay=opt.bind_ms / 1000.0,
+                                   search_delay=opt.search_ms / 1000.0)
+    fake_directory.seed_campus(opt.entries, base_dn=_BASE_DN)
+    fake_directory.register(_URI)
+
+    directory.LDAP_OBJECT_CLASS = FakeLDAPObject
+
+    netid_list = [ 'user%06d' % (i % opt.entries)
+                        for i in range(opt.lookups) ]
+
+    print 'directory: %d entries; latency (ms): connect %.1f  bind %.1f  ' \
+          'search %.1f' % (opt.entries, opt.connect_ms, opt.bind_ms,
+                           opt.search_ms)
+
+    #   Connect/bind cost.
+    def connect_bind():
+        '''Open and close unpooled connections.'''
+        for i in range(opt.lookups):
+            _connection().close()
+
+    _report('connect/bind', opt.lookups,
+            *_measure(fake_directory, connect_bind))
+
+    connection = _connection()
+
+    #   Single lookups over one connection.
+    def single():
+        '''Look up each netid separately.'''
+        for netid in netid_list:
+            connection.lookup_by_netid(netid)
+
+    _report('single lookup', opt.lookups, *_measure(fake_directory, single))
+
+    #   Batched lookups over one connection.
+    def batch():
+        '''Look up all netids in batches.'''
+        result_dict = connection.lookup_many_by_netid \
+                        (netid_list, batch_size=opt.batch_size)
+        assert len(result_dict) == len(set(netid_list))
+
+    _report('batch lookup', opt.lookups, *_measure(fake_directory, batch))
+
+    connection.close()
+
+    #   Throughput of open/lookup/close cycles, unpooled and pooled.
+    _report('unpooled (%d threads)' % opt.concurrency, opt.lookups,
+            *_measure(fake_directory, lambda: _throughput(opt)))
+
+    _report('pooled (%d threads)' % opt.concurrency, opt.lookups,
+            *_measure(fake_directory,
+                      lambda: _throughput(opt, pool_max=opt.pool_max)))
+
+    fake_directory.unregister(_URI)
+    return 0
+
+    #####
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
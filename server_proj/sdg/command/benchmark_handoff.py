@@ -0,0 +1,314 @@
+#   Copyright (c) 2010 by Jon R. Roma and the Board of Trustees of the
+#   University of Illinois. All rights reserved.
+
+'''
+Measures throughput of the session handoff protocol. Runs the handoff
+server view on a local WSGI server backed by a throwaway SQLite database
+and service secret, then drives concurrent announce/retrieve cycles.
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from httplib import HTTPConnection, HTTPResponse
+from optparse import OptionParser
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from sdg.hexdigest import generate_hexdigest, write_hexdigest
+
+_APPLICATION_ID = 'benchmark'
+
+#   Handoff server used by the view; set up by main().
+_SERVER = None
+
+#####
+
+class _FakeRequest(object):
+    '''Minimal stand-in for Django request; announce only uses session.'''
+
+    def __init__(self):
+        self.session = dict()
+
+#####
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    '''Request handler that doesn't log every request to stderr.'''
+
+    def log_message(self, *arg_list):
+        pass
+
+#####
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    '''WSGI server handling each request in its own thread.'''
+
+    daemon_threads = True
+
+#####
+
+class _Timer(object):
+    '''Thread-safe accumulator of elapsed time by category.'''
+
+    def __init__(self):
+        self.elapsed_dict   = dict()
+        self._lock          = threading.Lock()
+
+    #####
+
+    def add(self, category, elapsed):
+        '''Add elapsed seconds to category.'''
+        with self._lock:
+            self.elapsed_dict[category] = \
+                self.elapsed_dict.get(category, 0.0) + elapsed
+
+    #####
+
+    def get(self, category):
+        '''Return total seconds accumulated for category.'''
+        return self.elapsed_dict.get(category, 0.0)
+
+    #####
+
+    def wrap(self, category, func):
+        '''Return function that accumulates time spent in func.'''
+
+        timer = self
+
+        def wrapped(*arg_list, **kw_arg_dict):
+            '''Time wrapped function.'''
+            start = time.time()
+            try:
+                return func(*arg_list, **kw_arg_dict)
+            finally:
+                timer.add(category, time.time() - start)
+
+        return wrapped
+
+#####
+
+def _serve_view(request, method_name):
+    '''Django view passing handoff API requests to the server.'''
+    return _SERVER.serve_to_response(request, method_name)
+
+#####
+
+def _configure_django(db_path):
+    '''Configure Django for a standalone SQLite-backed handoff server.'''
+
+    from django.conf import settings
+
+    settings.configure \
+        (
+        DATABASES = \
+            {
+            'default' :
+                {
+                'ENGINE'    : 'django.db.backends.sqlite3',
+                'NAME'      : db_path,
+                'OPTIONS'   : { 'timeout' : 30 },
+                },
+            },
+        DEBUG               = False,
+        INSTALLED_APPS      = ('sdg.django.handoff', ),
+        MIDDLEWARE_CLASSES  = (),
+        ROOT_URLCONF        = sys.modules[__name__],
+        )
+
+    from django.conf.urls import patterns, url
+
+    #   pylint: disable=W0601
+    global urlpatterns
+    urlpatterns = patterns \
+        ('', url(r'^handoff/(?P<method_name>\w+)/$', _serve_view))
+
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+    return
+
+#####
+
+def _percentile(sorted_list, percent):
+    '''Return nearest-rank percentile from sorted list.'''
+
+    if not sorted_list:
+        return 0.0
+
+    index = int(round(percent / 100.0 * len(sorted_list) + 0.5)) - 1
+    return sorted_list[max(0, min(index, len(sorted_list) - 1))]
+
+#####
+
+def _run(url, service_secret_path, opt):
+    '''Drive handoff cycles; return list of cycle latencies.'''
+
+    from sdg.django.handoff import WSAPIAnnouncer, WSAPIClient
+
+    user_data   = { 'payload' : 'x' * opt.payload_size }
+    latency_list = []
+    lock        = threading.Lock()
+
+    #   Cycles are handed out from a shared counter.
+    remaining   = [ opt.cycles ]
+
+    client = WSAPIClient(application_id=_APPLICATION_ID,
+                         service_secret_path=service_secret_path)
+
+    def worker():
+        '''Perform announce/retrieve cycles until none remain.'''
+
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+
+            start = time.time()
+
+            announcer = WSAPIAnnouncer \
+                            (application_id=_APPLICATION_ID,
+                             service_secret_path=service_secret_path,
+                             compress_threshold=opt.compress_threshold)
+            announcer.announce(request=_FakeRequest(), user_data=user_data)
+
+            client.retrieve(url, announcer.session_public,
+                            passthrough=opt.passthrough)
+            end = time.time()
+
+            with lock:
+                latency_list.append(end - start)
+
+    thread_list = [ threading.Thread(target=worker)
+                        for i in range(opt.concurrency) ]
+
+    for thread in thread_list:
+        thread.start()
+
+    for thread in thread_list:
+        thread.join()
+
+    return latency_list
+
+#####
+
+def main(argv):
+    '''Main function.'''
+
+    #   pylint: disable=W0603
+    global _SERVER
+
+    opt_parser = OptionParser()
+
+    opt_parser.add_option('--cycles', dest='cycles', action='store',
+                          type='int', default=1000,
+                          help='number of announce/retrieve cycles')
+
+    opt_parser.add_option('--concurrency', dest='concurrency',
+                          action='store', type='int', default=4,
+                          help='number of concurrent client threads')
+
+    opt_parser.add_option('--payload-size', dest='payload_size',
+                          action='store', type='int', default=256,
+                          help='size in bytes of announced user data')
+
+    opt_parser.add_option('--compress-threshold', dest='compress_threshold',
+                          action='store', type='int', default=None,
+                          help='store user data this large compressed')
+
+    opt_parser.add_option('--passthrough', dest='passthrough',
+                          action='store_true', default=False,
+                          help='retrieve user data in pass-through mode')
+
+    #   Explicit reference to argv is for benefit of unittest.
+    opt, leftover_arg_list = opt_parser.parse_args(argv[1:])
+
+    if len(leftover_arg_list):
+        print >> sys.stderr, opt_parser.get_usage()
+        return 1
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_handoff.')
+
+    try:
+        service_secret_path = os.path.join(work_dir, 'service_secret')
+
+        write_hexdigest(generate_hexdigest(),
+                        path_random=service_secret_path,
+                        description='benchmark_handoff (throwaway)')
+
+        _configure_django(os.path.join(work_dir, 'handoff.db'))
+
+        from django.core.handlers.wsgi import WSGIHandler
+
+        from sdg.django.handoff import WSAPI, WSAPIServer
+        from sdg.django.handoff.models import AnnouncedSession
+
+        #   Instrument HMAC computation, database access on both sides of
+        #   the handoff, and server-side request handling.
+        timer = _Timer()
+
+        WSAPI._hash_with_service_secret = \
+            timer.wrap('hmac', WSAPI._hash_with_service_secret)
+        AnnouncedSession.save = timer.wrap('db', AnnouncedSession.save)
+        WSAPIServer._method_dict = dict \
+            ((name, timer.wrap('db', method))
+                for name, method in WSAPIServer._method_dict.items())
+        WSAPIServer.serve = timer.wrap('server', WSAPIServer.serve)
+
+        #   Instrument client's HTTP round trips (only the client uses
+        #   httplib), leaving out the hashing and encoding around them.
+        for http_class, name in ((HTTPConnection, 'connect'),
+                                 (HTTPConnection, 'request'),
+                                 (HTTPConnection, 'getresponse'),
+                                 (HTTPResponse, 'read')):
+            setattr(http_class, name,
+                    timer.wrap('http', getattr(http_class, name)))
+
+        _SERVER = WSAPIServer(service_secret_path=service_secret_path)
+
+        httpd = make_server('127.0.0.1', 0, WSGIHandler(),
+                            server_class=_ThreadingWSGIServer,
+                            handler_class=_QuietRequestHandler)
+
+        server_thread = threading.Thread(target=httpd.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        url = 'http://127.0.0.1:%d/handoff/' % httpd.server_port
+
+        start = time.time()
+        latency_list = _run(url, service_secret_path, opt)
+        elapsed = time.time() - start
+
+        httpd.shutdown()
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    count = len(latency_list)
+
+    cycle_list      = sorted(latency_list)
+
+    #   HTTP time is time client spent on round trips not spent inside the
+    #   server's request handling.
+    http_total      = max(0.0, timer.get('http') - timer.get('server'))
+
+    print 'handoffs:      %d in %.2fs (%.1f/s, concurrency %d)' % \
+        (count, elapsed, count / elapsed if elapsed else 0.0, opt.concurrency)
+
+    print 'latency (ms):  p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' % \
+        tuple(1000 * _percentile(cycle_list, p) for p in (50, 90, 99, 100))
+
+    print 'per handoff (ms): hmac %.2f  db %.2f  http %.2f' % \
+        tuple(1000 * t / count if count else 0.0
+                for t in (timer.get('hmac'), timer.get('db'), http_total))
+
+    return 0
+
+    #####
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
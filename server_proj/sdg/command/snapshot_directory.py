@@ -0,0 +1,89 @@
+#   Copyright (c) 2010 by Jon R. Roma and the Board of Trustees of the
+#   University of Illinois. All rights reserved.
+
+'''
+Writes a local, indexed snapshot of directory subtrees for use by
+sdg.directory.SnapshotDirectoryConnection.
+'''
+
+import logging
+import os
+import sys
+
+from optparse import OptionParser
+
+from sdg.config import ConfigFile
+from sdg.directory import ActiveDirectoryConnectionFromConfig, \
+    CampusLDAPConnectionFromConfig, write_directory_snapshot
+from sdg.log import StreamLog
+
+#   Factory functions keyed by configuration section name.
+_FACTORY_DICT = \
+    {
+    'ActiveDirectory'   : ActiveDirectoryConnectionFromConfig,
+    'CampusLDAP'        : CampusLDAPConnectionFromConfig,
+    }
+
+def main(argv):
+    '''Main function.'''
+
+    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+
+    StreamLog.init()
+
+    opt_parser = OptionParser()
+
+    opt_parser.add_option('--config', dest='config', action='store',
+                          help='configuration file describing directory')
+
+    opt_parser.add_option('--section', dest='section', action='store',
+                          default='CampusLDAP',
+                          help='configuration section (%s)' %
+                                ', '.join(sorted(_FACTORY_DICT)))
+
+    opt_parser.add_option('--base-dn', dest='base_dn_list', action='append',
+                          default=[],
+                          help='subtree to include (may be repeated)')
+
+    opt_parser.add_option('--filter', dest='ldap_filter', action='store',
+                          default='(objectClass=*)',
+                          help='filter selecting entries to include')
+
+    opt_parser.add_option('--attr', dest='attr_list', action='append',
+                          default=[],
+                          help='attribute to include (may be repeated)')
+
+    opt_parser.add_option('--output-file', dest='output_file_name',
+                          action='store',
+                          help='destination file for snapshot')
+
+    #   Explicit reference to argv is for benefit of unittest.
+    opt, leftover_arg_list = opt_parser.parse_args(argv[1:])
+
+    if len(leftover_arg_list) or not opt.config or \
+            not opt.output_file_name or opt.section not in _FACTORY_DICT:
+        print >> sys.stderr, opt_parser.get_usage()
+        return 1
+
+    try:
+        connection = _FACTORY_DICT[opt.section](ConfigFile(opt.config))
+
+        #   Default to base DN from configuration.
+        base_dn_list = opt.base_dn_list or [ connection.base_dn ]
+
+        write_directory_snapshot(connection, opt.output_file_name,
+                                 base_dn_list, opt.ldap_filter,
+                                 attr_list=opt.attr_list or None)
+        connection.close()
+
+    #   pylint: disable=W0703
+    except Exception, x:
+        logging.error(str(x))
+        return 1
+
+    return 0
+
+    #####
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
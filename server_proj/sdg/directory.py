@@ -10,10 +10,23 @@ Directory utility class for CITES Software Development Group applications.
 
 from __future__ import absolute_import
 
+import cPickle
+import hashlib
 import ldap
+import ldap.filter
 import logging
+import os
+import Queue
+import re
+import sqlite3
+import threading
+import time
 import warnings
 
+from collections import OrderedDict
+
+from ldap.controls import SimplePagedResultsControl
+
 from sdg import log
 
 #   Default object class for LDAP connection.
@@ -22,6 +35,53 @@ LDAP_OBJECT_CLASS   = ldap.ldapobject.ReconnectLDAPObject
 #   Initialize module logger.
 LOGGER = log.init_module_logger()
 
+_BATCH_SIZE_DEFAULT         = 100   # Default identifiers per batch filter.
+
+_CACHE_MAX_DEFAULT          = 10000 # Default maximum cached lookups.
+_CACHE_TTL_DEFAULT          = 300   # Default seconds lookups are cached.
+
+_FANOUT_DEADLINE_DEFAULT    = 5     # Default seconds per fan-out source.
+
+_PAGE_SIZE_DEFAULT          = 500   # Default entries per page.
+
+_POOL_CHECKOUT_TIMEOUT      = 30    # Seconds to wait for pooled connection.
+_POOL_HEALTH_CHECK_INTERVAL = 60    # Idle seconds before health check.
+_POOL_MAX_DEFAULT           = 4     # Default maximum pool size.
+_POOL_MIN_DEFAULT           = 0     # Default minimum pool size.
+
+_SLOW_QUERY_SECONDS_DEFAULT = 2     # Default seconds before query is slow.
+
+_SNAPSHOT_BATCH_SIZE        = 500   # Identifiers per snapshot query.
+
+#   Attributes (lower case) indexed in directory snapshots.
+_SNAPSHOT_INDEX_LIST        = \
+    [
+    'uiucedunetid',
+    'uiuceduregistryuniqueid',
+    'uiuceduuin',
+    ]
+
+#   LDAP options requiring a new TLS context to take effect.
+_TLS_OPTION_SET             = set(getattr(ldap, name) for name in
+                                    [ 'OPT_X_TLS_CACERTDIR',
+                                      'OPT_X_TLS_CACERTFILE',
+                                      'OPT_X_TLS_CERTFILE',
+                                      'OPT_X_TLS_KEYFILE',
+                                      'OPT_X_TLS_REQUIRE_CERT' ]
+                                    if hasattr(ldap, name))
+
+#   Filter escape sequence, e.g. \2a.
+_FILTER_ESCAPE_RE           = re.compile(r'\\([0-9a-fA-F]{2})')
+
+#   Assertion value in filter, masked in filter fingerprints.
+_FILTER_VALUE_RE            = re.compile(r'=[^()]*')
+
+#   Run of identical assertions, e.g. terms of a batched lookup filter.
+_FILTER_REPEAT_RE           = re.compile(r'(\([^()]*\))\1+')
+
+#   Simple equality filter, with or without enclosing parentheses.
+_SIMPLE_FILTER_RE           = re.compile(r'^\(?([A-Za-z][\w-]*)=([^()*]*)\)?$')
+
 #####
 
 class DirectoryConnection(object):
@@ -56,14 +116,29 @@ class DirectoryConnection(object):
     _opt_valid_dict = \
         {
         'base_dn'       : False,
+        'batch_size'    : False,
         'bind_dn'       : False,
+        'cache_backend' : False,
+        'cache_max'     : False,
+        'cache_negative_ttl' : False,
+        'cache_ttl'     : False,
+        'compact_entries' : False,
+        'page_size'     : False,
         'password'      : False,
+        'pool_max'      : False,
+        'pool_min'      : False,
         'retry_delay'   : False,
         'retry_max'     : False,
+        'slow_query_seconds' : False,
         'uri'           : True,
         'user'          : False,        ##### TODO deprecate in future
         }
 
+    #   LDAP options, as (option, value) tuples, set on each LDAP connection
+    #   rather than globally, so that connections to directories needing
+    #   different options can coexist in one process.
+    ldap_option_list = []
+
     #####
 
     def __init__(self, **opt_dict):
@@ -118,36 +193,94 @@ class DirectoryConnection(object):
         if 'base_dn' in opt_dict:
             self.base_dn   = opt_dict['base_dn']
 
-        LOGGER.debug('trying %s', opt_dict['uri'])
+        #   Maximum number of identifiers per filter in batched lookups.
+        self.batch_size = int(opt_dict.get('batch_size') or _BATCH_SIZE_DEFAULT)
+
+        #   Number of entries per page in paged searches.
+        self.page_size  = int(opt_dict.get('page_size') or _PAGE_SIZE_DEFAULT)
+
+        #   Class used to represent each directory entry returned by
+        #   lookups; compact entries are read-only and decode lazily.
+        #   (Option values from configuration files are strings.)
+        if str(opt_dict.get('compact_entries', '')).lower() in \
+                ('1', 'true', 'yes', 'on'):
+            self.response_class = DirectoryEntry
+
+        else:
+            self.response_class = DirectoryResponseDict
+
+        #   Result cache shared by connections with the same URI and bind
+        #   DN, if caching is configured.
+        self._cache     = None
+
+        if float(opt_dict.get('cache_ttl') or 0):
+            self._cache = DirectoryCache.get_cache(**opt_dict)
+
+        #   Searches taking at least this many seconds are logged.
+        self.slow_query_seconds = float(opt_dict.get('slow_query_seconds') or
+                                        _SLOW_QUERY_SECONDS_DEFAULT)
+
+        #   Query statistics shared by connections with the same URI.
+        self._stats     = DirectoryStats.get_stats(**opt_dict)
+
+        #   Connection pool from which LDAP connection was checked out, if
+        #   any. Connection stays None if checkout or connect fails, so that
+        #   close (called from __del__) has nothing to release.
+        self._pool      = None
+        self.connection = None
+
+        #   If pooling is configured, check out an already-bound connection
+        #   from the pool shared by all connections with the same URI and
+        #   bind DN. (Option values from configuration files are strings.)
+        if int(opt_dict.get('pool_max') or 0):
+            self._pool = DirectoryConnectionPool.get_pool \
+                            (ldap_option_list=self.ldap_option_list,
+                             **opt_dict)
+            self.connection = self._pool.checkout()
+            return
+
+        self.connection = _ldap_connect \
+                            (ldap_option_list=self.ldap_option_list,
+                             **opt_dict)
+        return
+
+    #####
+
+    def __del__(self):
+        #   Don't let a pooled connection leak if caller never closes it.
+        if getattr(self, '_pool', None):
+            self.close()
+        return
+
+    #####
+
+    def __enter__(self):
+        return self
+
+    #####
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
 
-        #   Initialize directory connection. The kw_args dict is used to
-        #   support keywords whose validity depends on which LDAP object
-        #   class is being constructed.
-        ldap_kw_args = dict()
+    #####
 
-        #   If we're using the ReconnectLDAPObject class, see if configuration
-        #   includes options pertinent to that module; if so, update them
-        #   into kw_args.
-        if issubclass(LDAP_OBJECT_CLASS, ldap.ldapobject.ReconnectLDAPObject):
-            if 'retry_delay' in opt_dict:
-                ldap_kw_args.update(dict(retry_delay=opt_dict['retry_delay']))
-            if 'retry_max' in opt_dict:
-                ldap_kw_args.update(dict(retry_max=opt_dict['retry_max']))
+    def close(self):
+        '''
+        Release directory connection. A pooled connection is returned to its
+        pool; otherwise the connection is unbound.
+        '''
 
-        #   Initialize LDAP connection.
-        self.connection = LDAP_OBJECT_CLASS(opt_dict['uri'], **ldap_kw_args)
-        LOGGER.debug('connected to %s', opt_dict['uri'])
+        if self.connection is None:
+            return
 
-        #   If credentials are specified, bind to them.
-        if 'bind_dn' in opt_dict and 'password' in opt_dict:
-            LOGGER.debug('binding as %s', opt_dict['bind_dn'])
-            self.connection.simple_bind_s \
-                (opt_dict['bind_dn'], opt_dict['password'])
+        if self._pool:
+            self._pool.checkin(self.connection)
 
         else:
-            #   Not using bound connection.
-            LOGGER.debug('using unbound connection')
+            self.connection.unbind_s()
 
+        self.connection = None
         return
 
     #####
@@ -181,17 +314,202 @@ class DirectoryConnection(object):
         if not base_dn:
             raise DirectoryConnection.BaseDNMissingError('no base_dn specified')
 
+        #   Return cached result if present.
+        if self._cache:
+            cache_key = DirectoryCache.make_key(base_dn, ldap_filter, attr_list,
+                                                self.response_class)
+            response_list = self._cache.get(cache_key)
+
+            if response_list is not None:
+                self._stats.record_cache_hit(ldap_filter)
+                return response_list
+
         #   Perform LDAP search.
-        result_list = self.connection.search_s \
-                        (base_dn, ldap.SCOPE_SUBTREE, ldap_filter,
-                         attrlist=attr_list)
+        start = time.time()
+
+        try:
+            result_list = self.connection.search_s \
+                            (base_dn, ldap.SCOPE_SUBTREE, ldap_filter,
+                             attrlist=attr_list)
+
+        except ldap.LDAPError:
+            self._record_query(ldap_filter, base_dn, time.time() - start, 0,
+                               is_error=True)
+            raise
+
+        self._record_query(ldap_filter, base_dn, time.time() - start,
+                           len(result_list))
 
         #   Create DirectoryResponseList containing DirectoryResponseDict
         #   object for each entry returned from directory server.
-        return DirectoryResponseList \
-                ((dn, DirectoryResponseDict(attr_dict))
+        response_list = DirectoryResponseList \
+                ((dn, self.response_class(attr_dict))
                     for dn, attr_dict in result_list)
 
+        if self._cache:
+            self._cache.set(cache_key, response_list)
+
+        return response_list
+
+    #####
+
+    #   pylint: disable=W0622
+    def iter_lookup(self, ldap_filter, attr_list=None, base_dn=None,
+                    page_size=None):
+        '''
+        Generator version of lookup that yields (dn, entry) tuples as
+        entries arrive. Uses the Simple Paged Results control so
+        that searches of large subtrees neither exceed server size limits
+        nor hold the whole result in memory. Results aren't cached.
+        '''
+
+        #   If no attr_list supplied on method call, use attr_list from
+        #   constructor.
+        if not attr_list:
+            attr_list = self.attr_list
+
+        #   If no base_dn supplied on method call, use base_dn from constructor.
+        if not base_dn:
+            base_dn = self.base_dn
+
+        #   No base_dn supplied on either method call or constructor.
+        if not base_dn:
+            raise DirectoryConnection.BaseDNMissingError('no base_dn specified')
+
+        if not page_size:
+            page_size = self.page_size
+
+        page_control = SimplePagedResultsControl \
+                        (True, size=page_size, cookie='')
+
+        #   Statistics count time spent waiting for the server, not time
+        #   the caller spends between entries.
+        count       = 0
+        elapsed     = 0.0
+        is_error    = False
+
+        try:
+            while True:
+                #   Issue asynchronous search for next page.
+                start = time.time()
+                msgid = self.connection.search_ext \
+                            (base_dn, ldap.SCOPE_SUBTREE, ldap_filter,
+                             attrlist=attr_list, serverctrls=[page_control])
+                elapsed += time.time() - start
+
+                page_done = False
+
+                try:
+                    #   Retrieve entries one at a time until page is complete.
+                    while not page_done:
+                        start = time.time()
+                        rtype, rdata, rmsgid, serverctrls = \
+                            self.connection.result3(msgid, all=0)
+                        elapsed += time.time() - start
+
+                        if rtype == ldap.RES_SEARCH_ENTRY:
+                            for dn, attr_dict in rdata:
+                                count += 1
+                                yield dn, self.response_class(attr_dict)
+
+                        elif rtype == ldap.RES_SEARCH_RESULT:
+                            page_done = True
+
+                finally:
+                    #   Caller stopped iterating mid-page; abandon search.
+                    if not page_done:
+                        self.connection.abandon(msgid)
+
+                #   Server returns empty cookie after last page; server that
+                #   doesn't support paging returns no control at all.
+                cookie = None
+
+                for control in serverctrls:
+                    if control.controlType == \
+                            SimplePagedResultsControl.controlType:
+                        cookie = control.cookie
+
+                if not cookie:
+                    return
+
+                page_control.cookie = cookie
+
+        except ldap.LDAPError:
+            is_error = True
+            raise
+
+        finally:
+            self._record_query(ldap_filter, base_dn, elapsed, count,
+                               is_error=is_error)
+
+    #####
+
+    def _lookup_many(self, id_attr, id_list, batch_size=None):
+        '''
+        Look up entries whose id_attr attribute matches any of the
+        identifiers in id_list, using OR filters of at most batch_size
+        terms. Returns dictionary keyed by identifier (as supplied) whose
+        values are DirectoryResponseList objects; identifiers matching no
+        entry are omitted.
+        '''
+
+        if not batch_size:
+            batch_size = self.batch_size
+
+        #   Identifier attribute must be returned so that entries can be
+        #   matched to identifiers.
+        attr_list = self.attr_list
+
+        if attr_list and \
+                id_attr.lower() not in [ a.lower() for a in attr_list ]:
+            attr_list = list(attr_list) + [ id_attr ]
+
+        #   Map case-folded identifiers to identifiers as supplied, dropping
+        #   duplicates but preserving order.
+        id_dict = OrderedDict((str(i).lower(), i) for i in id_list)
+        key_list = id_dict.keys()
+
+        result_dict = dict()
+
+        for start in range(0, len(key_list), batch_size):
+            ldap_filter = '(|%s)' % ''.join \
+                ('(%s=%s)' % (id_attr, ldap.filter.escape_filter_chars(key))
+                    for key in key_list[start:start + batch_size])
+
+            for dn, entry in self.lookup(ldap_filter, attr_list=attr_list):
+                #   Server may return attribute name in different case.
+                for attr_name, value_list in entry.items():
+                    if attr_name.lower() != id_attr.lower():
+                        continue
+
+                    for value in value_list:
+                        ident = id_dict.get(value.lower())
+
+                        if ident is not None:
+                            result_dict.setdefault \
+                                (ident, DirectoryResponseList()) \
+                                .append((dn, entry))
+
+        return result_dict
+
+    #####
+
+    def _record_query(self, ldap_filter, base_dn, elapsed, count,
+                      is_error=False):
+        '''Record statistics for search taking elapsed seconds; log if slow.'''
+
+        is_slow = elapsed >= self.slow_query_seconds
+
+        self._stats.record(ldap_filter, elapsed, count, is_error=is_error,
+                           is_slow=is_slow)
+
+        if is_slow:
+            LOGGER.warning('slow directory query (%.3fs, %d entries) ' +
+                           'on %s: base %s filter %s', elapsed, count,
+                           self._stats.uri, base_dn, ldap_filter)
+
+        return
+
     #####
 
     #   pylint: disable=W0622
@@ -231,79 +549,1295 @@ class DirectoryConnection(object):
 
 #####
 
-#   pylint: disable=C0103
-class ActiveDirectoryConnection(DirectoryConnection):
-    '''Class for retrieving data from the CITES Active Directory server.'''
+class DirectoryConnectionPool(object):
+    '''
+    Thread-safe pool of bound LDAP connections sharing a URI, bind DN and
+    LDAP options.
+    Applications ordinarily don't use this class directly; instead they
+    specify the pool_min and pool_max options when constructing a
+    DirectoryConnection, whose close() method returns its connection to
+    the pool.
+    '''
+
+    class PoolExhaustedError(Exception):
+        '''
+        Exception raised when no pooled connection became available within
+        the checkout timeout.
+        '''
+        pass
+
+    #   Dictionary of pools keyed by URI, bind DN and LDAP options.
+    _pool_dict      = dict()
+    _pool_dict_lock = threading.Lock()
 
     #####
 
-    def lookup_by_netid(self, netid):
-        '''Look up Active Directory entry by netid.'''
+    def __init__(self, pool_min=_POOL_MIN_DEFAULT, pool_max=_POOL_MAX_DEFAULT,
+                 **opt_dict):
+        '''Initialize pool and open pool_min connections.'''
 
-        return self.lookup(ldap_filter='cn=' + netid)
+        self.pool_min   = int(pool_min)
+        self.pool_max   = max(int(pool_max), self.pool_min, 1)
+
+        #   Options used to open each connection.
+        self._opt_dict  = opt_dict
+
+        #   Idle connections, each with the time it was checked in.
+        self._idle_list = []
+
+        #   Number of connections open, whether idle or checked out.
+        self._open      = 0
+
+        self._cond      = threading.Condition(threading.Lock())
+
+        for i in range(self.pool_min):
+            self._idle_list.append((_ldap_connect(**opt_dict), time.time()))
+            self._open += 1
+
+        return
+
+    #####
+
+    @classmethod
+    def get_pool(cls, **opt_dict):
+        '''
+        Return pool for URI, bind DN and LDAP options in opt_dict, creating
+        it on first use. Pool sizes are taken from the options that created
+        the pool.
+        '''
+
+        key = (opt_dict['uri'], opt_dict.get('bind_dn'),
+               tuple(opt_dict.get('ldap_option_list') or ()))
+
+        with cls._pool_dict_lock:
+            if key not in cls._pool_dict:
+                pool_opt_dict = dict(opt_dict)
+                pool_opt_dict.setdefault('pool_min', _POOL_MIN_DEFAULT)
+                pool_opt_dict.setdefault('pool_max', _POOL_MAX_DEFAULT)
+                cls._pool_dict[key] = cls(**pool_opt_dict)
+
+            return cls._pool_dict[key]
+
+    #####
+
+    def checkin(self, connection, discard=False):
+        '''
+        Return connection to pool. If discard is true, connection is unbound
+        rather than reused.
+        '''
+
+        with self._cond:
+            if discard:
+                self._open -= 1
+
+            else:
+                self._idle_list.append((connection, time.time()))
+
+            self._cond.notify()
+
+        if discard:
+            _ldap_unbind(connection)
+
+        return
+
+    #####
+
+    def checkout(self, timeout=_POOL_CHECKOUT_TIMEOUT):
+        '''
+        Return a bound connection from pool, opening a new one if none is
+        idle and pool isn't full; otherwise wait up to timeout seconds for
+        one to be returned. Connections idle longer than the health-check
+        interval are verified before being handed out.
+        '''
+
+        deadline = time.time() + timeout
+
+        while True:
+            with self._cond:
+                while not self._idle_list and self._open >= self.pool_max:
+                    remaining = deadline - time.time()
+
+                    if remaining <= 0:
+                        raise self.PoolExhaustedError \
+                            ('no connection to %s available within %ss' %
+                             (self._opt_dict['uri'], timeout))
+
+                    self._cond.wait(remaining)
+
+                if self._idle_list:
+                    connection, idle_since = self._idle_list.pop()
+
+                else:
+                    #   Reserve slot; connect outside lock.
+                    connection, idle_since = None, None
+                    self._open += 1
+
+            if connection is None:
+                try:
+                    return _ldap_connect(**self._opt_dict)
+
+                except:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+
+            #   Connection used recently enough to be trusted.
+            if time.time() - idle_since < _POOL_HEALTH_CHECK_INTERVAL:
+                return connection
+
+            if _ldap_is_healthy(connection):
+                return connection
+
+            LOGGER.debug('discarding unhealthy connection to %s',
+                         self._opt_dict['uri'])
+            self.checkin(connection, discard=True)
 
 #####
 
-#   pylint: disable=C0103
-def ActiveDirectoryConnectionFromConfig(config, **opt_dict):
+class DirectoryCache(object):
     '''
-    Factory method for returning ActiveDirectory connection specified in a
-    configuration file; the config argument must be a sdg.config.Config object.
+    Cache of DirectoryConnection.lookup results keyed by base DN, filter
+    and attribute list. Entries expire after cache_ttl seconds; empty
+    results expire after cache_negative_ttl seconds (0 disables negative
+    caching). The in-process cache holds at most cache_max entries,
+    discarding the least recently used. If cache_backend names a Django
+    cache, that cache is used instead so results are shared between
+    processes. Applications ordinarily enable caching by specifying these
+    options when constructing a DirectoryConnection.
     '''
 
-    #   pylint: disable=W0212
-    opt_dict = config.validate_section \
-                ('ActiveDirectory', 
-                 DirectoryConnection._get_valid_option_dict(), **opt_dict)
+    #   Dictionary of caches keyed by URI and bind DN.
+    _cache_dict         = dict()
+    _cache_dict_lock    = threading.Lock()
 
-    ldap.set_option(ldap.OPT_REFERRALS, 0)
-    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+    #####
 
-    return ActiveDirectoryConnection(**opt_dict)
+    def __init__(self, cache_ttl=_CACHE_TTL_DEFAULT,
+                 cache_max=_CACHE_MAX_DEFAULT, cache_negative_ttl=None,
+                 cache_backend=None, **opt_dict):
+        '''Initialize cache.'''
+
+        self.cache_max          = int(cache_max)
+        self.cache_ttl          = float(cache_ttl)
+
+        #   Negative results are cached as long as others unless specified.
+        if cache_negative_ttl is None:
+            self.cache_negative_ttl = self.cache_ttl
+
+        else:
+            self.cache_negative_ttl = float(cache_negative_ttl)
+
+        #   Django cache, if any, and prefix distinguishing this cache's keys.
+        self._backend   = None
+        self._prefix    = 'sdg.directory:%s:' % hashlib.sha1 \
+            (repr((opt_dict.get('uri'), opt_dict.get('bind_dn')))).hexdigest()
+
+        if cache_backend:
+            #   pylint: disable=F0401
+            from django.core.cache import get_cache
+            self._backend = get_cache(cache_backend)
+
+        #   In-process entries, each a 2-tuple of expiry time and result, in
+        #   least- to most-recently used order.
+        self._entry_dict    = OrderedDict()
+        self._lock          = threading.Lock()
+        return
 
-#####
-    
-class CampusLDAPConnection(DirectoryConnection):
-    '''Class for retrieving data from the CITES Campus LDAP server.'''
-    
     #####
 
-    def lookup_by_netid(self, netid):
-        '''Look up Campus LDAP entry by netid.'''
+    @classmethod
+    def get_cache(cls, **opt_dict):
+        '''
+        Return cache for URI and bind DN in opt_dict, creating it on first
+        use. Cache settings are taken from the options that created it.
+        '''
 
-        return self.lookup(ldap_filter='uiucEduNetID=' + netid)
+        key = (opt_dict['uri'], opt_dict.get('bind_dn'))
+
+        with cls._cache_dict_lock:
+            if key not in cls._cache_dict:
+                cls._cache_dict[key] = cls(**opt_dict)
+
+            return cls._cache_dict[key]
 
     #####
 
-    def lookup_by_registry_unique_id(self, unique_id):
-        '''Look up Central Registry entry by registry unique ID.'''
+    @staticmethod
+    def make_key(base_dn, ldap_filter, attr_list, response_class=None):
+        '''
+        Return cache key for search. Results are cached separately for
+        each class of entry (see the compact_entries option), since
+        connections sharing a cache may use different classes.
+        '''
 
-        return self.lookup(ldap_filter='uiucEduRegistryUniqueID=' + unique_id)
+        return (response_class and response_class.__name__, base_dn,
+                ldap_filter, tuple(attr_list or ()))
 
     #####
 
-    def lookup_by_uin(self, uin):
-        '''Look up Central Registry entry by UIN.'''
+    def clear(self):
+        '''Discard in-process entries.'''
 
-        return self.lookup(ldap_filter='uiucEduUIN=' + uin)
+        with self._lock:
+            self._entry_dict.clear()
+
+        return
+
+    #####
+
+    @staticmethod
+    def _copy(response_list):
+        '''
+        Return copy of DirectoryResponseList whose entries can be altered
+        without affecting the original. DirectoryEntry objects are
+        read-only, so they are shared rather than copied.
+        '''
+
+        copy_list = DirectoryResponseList()
+
+        for dn, entry in response_list:
+            if not isinstance(entry, DirectoryEntry):
+                entry = entry.__class__((attr_name, list(value_list))
+                    for attr_name, value_list in entry.iteritems())
+
+            copy_list.append((dn, entry))
+
+        return copy_list
+
+    #####
+
+    def get(self, key):
+        '''
+        Return copy of cached DirectoryResponseList, or None if key isn't
+        cached or has expired. Entries of the copy can be altered without
+        affecting the cached result.
+        '''
+
+        if self._backend:
+            result = self._backend.get(self._backend_key(key))
+
+        else:
+            with self._lock:
+                entry = self._entry_dict.pop(key, None)
+
+                if entry is None:
+                    return None
+
+                expire_time, result = entry
+
+                if expire_time <= time.time():
+                    return None
+
+                #   Re-insert as most recently used.
+                self._entry_dict[key] = entry
+
+        if result is None:
+            return None
+
+        return self._copy(result)
+
+    #####
+
+    def set(self, key, response_list):
+        '''Cache copy of DirectoryResponseList.'''
+
+        if response_list:
+            ttl = self.cache_ttl
+
+        else:
+            ttl = self.cache_negative_ttl
+
+        if ttl <= 0:
+            return
+
+        #   Store a copy so caller can't alter cached result or its entries.
+        response_list = self._copy(response_list)
+
+        if self._backend:
+            self._backend.set(self._backend_key(key), response_list, int(ttl))
+            return
+
+        with self._lock:
+            self._entry_dict.pop(key, None)
+            self._entry_dict[key] = (time.time() + ttl, response_list)
+
+            #   Discard least recently used entries beyond maximum.
+            while len(self._entry_dict) > self.cache_max:
+                self._entry_dict.popitem(last=False)
+
+        return
+
+    #####
+
+    def _backend_key(self, key):
+        '''Return key usable with any Django cache backend.'''
+        return self._prefix + hashlib.sha1(repr(key)).hexdigest()
 
 #####
 
-def CampusLDAPConnectionFromConfig(config, **opt_dict):
+class DirectoryStats(object):
     '''
-    Factory method for returning Campus LDAP connection specified in a
-    configuration file; the config argument must be a sdg.config.Config object.
+    Thread-safe registry of lookup statistics for one directory URI:
+    overall counters, plus per-filter counts, durations and result counts
+    keyed by filter fingerprint (the filter with assertion values masked,
+    so that e.g. all netid lookups share one fingerprint). snapshot()
+    returns a copy suitable for rendering on a dashboard.
     '''
 
-    #   pylint: disable=W0212
-    opt_dict = config.validate_section \
-                ('CampusLDAP', DirectoryConnection._get_valid_option_dict(),
-                 **opt_dict)
+    #   Dictionary of statistics keyed by URI.
+    _stats_dict         = dict()
+    _stats_dict_lock    = threading.Lock()
 
-    ldap.set_option(ldap.OPT_REFERRALS, 1)
-    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_TRY)
+    #   Counters kept overall and per fingerprint.
+    _COUNTER_LIST       = [ 'cache_hits', 'entries', 'errors', 'max_seconds',
+                            'queries', 'seconds', 'slow' ]
 
-    return CampusLDAPConnection(**opt_dict)
+    #####
+
+    def __init__(self, uri=None, **opt_dict):
+        '''Initialize statistics.'''
+
+        #   pylint: disable=W0613
+        self.uri = uri
+
+        self._lock = threading.Lock()
+        self.reset()
+        return
+
+    #####
+
+    @classmethod
+    def get_stats(cls, **opt_dict):
+        '''
+        Return statistics for URI in opt_dict, creating them on first use.
+        '''
+
+        key = opt_dict.get('uri')
+
+        with cls._stats_dict_lock:
+            if key not in cls._stats_dict:
+                cls._stats_dict[key] = cls(**opt_dict)
+
+            return cls._stats_dict[key]
+
+    #####
+
+    @classmethod
+    def snapshot_all(cls):
+        '''Return dictionary of snapshot() results keyed by URI.'''
+
+        with cls._stats_dict_lock:
+            stats_list = cls._stats_dict.values()
+
+        return dict((stats.uri, stats.snapshot()) for stats in stats_list)
+
+    #####
+
+    @staticmethod
+    def fingerprint(ldap_filter):
+        '''
+        Return filter with assertion values masked and runs of identical
+        assertions collapsed, e.g. (|(uiucEduUIN=?)...) for any batch of
+        UINs.
+        '''
+
+        fingerprint = _FILTER_VALUE_RE.sub('=?', ldap_filter)
+        return _FILTER_REPEAT_RE.sub(r'\1...', fingerprint)
+
+    #####
+
+    def _counter_dict(self):
+        '''Return new dictionary of zeroed counters.'''
+        return dict((name, 0) for name in self._COUNTER_LIST)
+
+    #####
+
+    def record(self, ldap_filter, seconds, count, is_error=False,
+               is_slow=False):
+        '''Record search taking seconds and returning count entries.'''
+
+        fingerprint = self.fingerprint(ldap_filter)
+
+        with self._lock:
+            for counter_dict in (self._total_dict,
+                                 self._query_dict.setdefault
+                                    (fingerprint, self._counter_dict())):
+                counter_dict['entries']     += count
+                counter_dict['errors']      += int(is_error)
+                counter_dict['queries']     += 1
+                counter_dict['seconds']     += seconds
+                counter_dict['slow']        += int(is_slow)
+
+                counter_dict['max_seconds'] = \
+                    max(counter_dict['max_seconds'], seconds)
+
+        return
+
+    #####
+
+    def record_cache_hit(self, ldap_filter):
+        '''Record lookup answered from cache.'''
+
+        fingerprint = self.fingerprint(ldap_filter)
+
+        with self._lock:
+            self._total_dict['cache_hits'] += 1
+            self._query_dict.setdefault \
+                (fingerprint, self._counter_dict())['cache_hits'] += 1
+
+        return
+
+    #####
+
+    def reset(self):
+        '''Zero all statistics.'''
+
+        with self._lock:
+            self._since         = time.time()
+            self._query_dict    = dict()
+            self._total_dict    = self._counter_dict()
+
+        return
+
+    #####
+
+    def snapshot(self):
+        '''
+        Return dictionary containing uri, since (time statistics began),
+        overall counters and a query dictionary of counters keyed by
+        filter fingerprint. Counters are cache_hits, entries, errors,
+        max_seconds, queries, seconds (total) and slow.
+        '''
+
+        with self._lock:
+            result = dict(self._total_dict)
+            result['uri']       = self.uri
+            result['since']     = self._since
+            result['query']     = dict((fingerprint, dict(counter_dict))
+                                        for fingerprint, counter_dict in
+                                            self._query_dict.items())
+
+        return result
+
+#####
+
+def _ldap_connect(ldap_option_list=None, **opt_dict):
+    '''
+    Open LDAP connection, set LDAP options in ldap_option_list on it, and
+    bind it if credentials are specified.
+    '''
+
+    LOGGER.debug('trying %s', opt_dict['uri'])
+
+    #   Initialize directory connection. The kw_args dict is used to
+    #   support keywords whose validity depends on which LDAP object
+    #   class is being constructed.
+    ldap_kw_args = dict()
+
+    #   If we're using the ReconnectLDAPObject class, see if configuration
+    #   includes options pertinent to that module; if so, update them
+    #   into kw_args.
+    if issubclass(LDAP_OBJECT_CLASS, ldap.ldapobject.ReconnectLDAPObject):
+        if 'retry_delay' in opt_dict:
+            ldap_kw_args.update(dict(retry_delay=opt_dict['retry_delay']))
+        if 'retry_max' in opt_dict:
+            ldap_kw_args.update(dict(retry_max=opt_dict['retry_max']))
+
+    #   Initialize LDAP connection.
+    connection = LDAP_OBJECT_CLASS(opt_dict['uri'], **ldap_kw_args)
+    LOGGER.debug('connected to %s', opt_dict['uri'])
+
+    #   Set options on this connection only. ReconnectLDAPObject records
+    #   options set this way and reapplies them when it reconnects.
+    for option, value in ldap_option_list or ():
+        connection.set_option(option, value)
+
+    #   TLS options set on a connection take effect only once a new TLS
+    #   context is created for it (where python-ldap supports doing so).
+    if hasattr(ldap, 'OPT_X_TLS_NEWCTX') and \
+            any(o in _TLS_OPTION_SET for o, v in ldap_option_list or ()):
+        connection.set_option(ldap.OPT_X_TLS_NEWCTX, 0)
+
+    #   If credentials are specified, bind to them.
+    if 'bind_dn' in opt_dict and 'password' in opt_dict:
+        LOGGER.debug('binding as %s', opt_dict['bind_dn'])
+        connection.simple_bind_s(opt_dict['bind_dn'], opt_dict['password'])
+
+    else:
+        #   Not using bound connection.
+        LOGGER.debug('using unbound connection')
+
+    return connection
+
+#####
+
+def _ldap_is_healthy(connection):
+    '''Return Boolean indicating whether connection still responds.'''
+
+    try:
+        connection.whoami_s()
+
+    except ldap.LDAPError:
+        return False
+
+    return True
+
+#####
+
+def _ldap_unbind(connection):
+    '''Unbind connection, ignoring errors from a connection already lost.'''
+
+    try:
+        connection.unbind_s()
+
+    except ldap.LDAPError:
+        pass
+
+    return
+
+#####
+
+#   pylint: disable=C0103
+class ActiveDirectoryConnection(DirectoryConnection):
+    '''Class for retrieving data from the CITES Active Directory server.'''
+
+    ldap_option_list = \
+        [
+        (ldap.OPT_REFERRALS,            0),
+        (ldap.OPT_X_TLS_REQUIRE_CERT,   ldap.OPT_X_TLS_NEVER),
+        ]
+
+    #####
+
+    def lookup_by_netid(self, netid):
+        '''Look up Active Directory entry by netid.'''
+
+        return self.lookup(ldap_filter='cn=' + netid)
+
+#####
+
+#   pylint: disable=C0103
+def ActiveDirectoryConnectionFromConfig(config, **opt_dict):
+    '''
+    Factory method for returning ActiveDirectory connection specified in a
+    configuration file; the config argument must be a sdg.config.Config object.
+    '''
+
+    #   pylint: disable=W0212
+    opt_dict = config.validate_section \
+                ('ActiveDirectory', 
+                 DirectoryConnection._get_valid_option_dict(), **opt_dict)
+
+    return ActiveDirectoryConnection(**opt_dict)
+
+#####
+    
+class CampusLDAPConnection(DirectoryConnection):
+    '''Class for retrieving data from the CITES Campus LDAP server.'''
+
+    ldap_option_list = \
+        [
+        (ldap.OPT_REFERRALS,            1),
+        (ldap.OPT_X_TLS_REQUIRE_CERT,   ldap.OPT_X_TLS_TRY),
+        ]
+
+    #####
+
+    def lookup_by_netid(self, netid):
+        '''Look up Campus LDAP entry by netid.'''
+
+        return self.lookup(ldap_filter='uiucEduNetID=' + netid)
+
+    #####
+
+    def lookup_by_registry_unique_id(self, unique_id):
+        '''Look up Central Registry entry by registry unique ID.'''
+
+        return self.lookup(ldap_filter='uiucEduRegistryUniqueID=' + unique_id)
+
+    #####
+
+    def lookup_many_by_netid(self, netid_list, batch_size=None):
+        '''
+        Look up Campus LDAP entries for several netids in as few searches
+        as possible. Returns dictionary keyed by netid.
+        '''
+
+        return self._lookup_many('uiucEduNetID', netid_list,
+                                 batch_size=batch_size)
+
+    #####
+
+    def lookup_many_by_uin(self, uin_list, batch_size=None):
+        '''
+        Look up Central Registry entries for several UINs in as few searches
+        as possible. Returns dictionary keyed by UIN.
+        '''
+
+        return self._lookup_many('uiucEduUIN', uin_list, batch_size=batch_size)
+
+    #####
+
+    def lookup_by_uin(self, uin):
+        '''Look up Central Registry entry by UIN.'''
+
+        return self.lookup(ldap_filter='uiucEduUIN=' + uin)
+
+#####
+
+def CampusLDAPConnectionFromConfig(config, **opt_dict):
+    '''
+    Factory method for returning Campus LDAP connection specified in a
+    configuration file; the config argument must be a sdg.config.Config object.
+    '''
+
+    #   pylint: disable=W0212
+    opt_dict = config.validate_section \
+                ('CampusLDAP', DirectoryConnection._get_valid_option_dict(),
+                 **opt_dict)
+
+    return CampusLDAPConnection(**opt_dict)
+
+#####
+
+class SnapshotDirectoryConnection(CampusLDAPConnection):
+    '''
+    Class for retrieving Campus LDAP entries from a local snapshot written
+    by write_directory_snapshot (see sdg.command.snapshot_directory)
+    rather than from the directory server. Supports the lookup_by_* and
+    lookup_many_by_* methods of CampusLDAPConnection; the generic lookup
+    method accepts only simple equality filters on indexed attributes, and
+    raises ldap.FILTER_ERROR for others.
+    '''
+
+    #   Dictionary of configuration keywords and whether they are required.
+    _opt_valid_dict = \
+        {
+        'attr_list'         : False,
+        'base_dn'           : False,
+        'batch_size'        : False,
+        'compact_entries'   : False,
+        'path'              : True,
+        }
+
+    #####
+
+    #   pylint: disable=W0231
+    def __init__(self, **opt_dict):
+        '''Open directory snapshot; no directory server is contacted.'''
+
+        for kw, required in self._get_valid_option_dict().items():
+            if required and not opt_dict.get(kw):
+                raise Exception \
+                        ('required option \'%s\' missing or invalid' % kw)
+
+        self.attr_list  = opt_dict.get('attr_list', [])
+        self.base_dn    = opt_dict.get('base_dn')
+        self.batch_size = int(opt_dict.get('batch_size') or
+                              _SNAPSHOT_BATCH_SIZE)
+
+        if str(opt_dict.get('compact_entries', '')).lower() in \
+                ('1', 'true', 'yes', 'on'):
+            self.response_class = DirectoryEntry
+
+        else:
+            self.response_class = DirectoryResponseDict
+
+        if not os.path.exists(opt_dict['path']):
+            raise IOError('directory snapshot \'%s\' not found' %
+                          opt_dict['path'])
+
+        self._cache     = None
+        self._pool      = None
+
+        #   SQLite connection is shared between threads under a lock.
+        self._lock      = threading.Lock()
+        self.connection = sqlite3.connect(opt_dict['path'],
+                                          check_same_thread=False)
+        return
+
+    #####
+
+    def close(self):
+        '''Close directory snapshot.'''
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+        return
+
+    #####
+
+    def _fetch(self, attr_name, value_list, attr_list, base_dn):
+        '''
+        Return list of (dn, attr_dict, matched value) tuples for entries
+        whose indexed attribute matches any value in value_list.
+        '''
+
+        if attr_name.lower() not in _SNAPSHOT_INDEX_LIST:
+            raise _snapshot_filter_error \
+                ('attribute %s is not indexed in directory snapshot' %
+                 attr_name)
+
+        attr_set = set(a.lower() for a in attr_list or ())
+        row_list = []
+
+        value_list = [ v.lower() for v in value_list ]
+
+        with self._lock:
+            for start in range(0, len(value_list), _SNAPSHOT_BATCH_SIZE):
+                chunk = value_list[start:start + _SNAPSHOT_BATCH_SIZE]
+
+                row_list.extend(self.connection.execute \
+                    ('SELECT e.dn, e.attr_data, k.value ' 
+                     'FROM entry_key k JOIN entry e ON e.id = k.entry_id '
+                     'WHERE k.attr = ? AND k.value IN (%s)' %
+                        ', '.join('?' * len(chunk)),
+                     [ attr_name.lower() ] + chunk))
+
+        result_list = []
+
+        base_dn = base_dn.lower() if base_dn else None
+
+        for dn, attr_data, value in row_list:
+            #   Honor base DN as a subtree search would: the entry must be
+            #   the base itself or lie below it at an RDN boundary.
+            dn_lower = dn.lower()
+
+            if base_dn and dn_lower != base_dn and \
+                    not dn_lower.endswith(',' + base_dn):
+                continue
+
+            attr_dict = cPickle.loads(str(attr_data))
+
+            #   Restrict attributes returned as a search would.
+            if attr_set:
+                attr_dict = dict((k, v) for k, v in attr_dict.items()
+                                    if k.lower() in attr_set)
+
+            result_list.append((dn.encode('utf-8'), attr_dict, value))
+
+        return result_list
+
+    #####
+
+    #   pylint: disable=W0622
+    def iter_lookup(self, ldap_filter, attr_list=None, base_dn=None,
+                    page_size=None):
+        '''Generator version of lookup.'''
+
+        return iter(self.lookup(ldap_filter, attr_list=attr_list,
+                                base_dn=base_dn))
+
+    #####
+
+    #   pylint: disable=W0622
+    def lookup(self, ldap_filter, attr_list=None, base_dn=None):
+        '''
+        Search snapshot using a simple equality filter, such as
+        uiucEduNetID=jdoe, on an indexed attribute.
+        '''
+
+        if not attr_list:
+            attr_list = self.attr_list
+
+        if not base_dn:
+            base_dn = self.base_dn
+
+        match = _SIMPLE_FILTER_RE.match(ldap_filter)
+
+        if not match:
+            raise _snapshot_filter_error \
+                ('filter \'%s\' not supported by directory snapshot' %
+                 ldap_filter)
+
+        attr_name, value = match.groups()
+
+        #   Undo filter escaping of assertion value.
+        value = _FILTER_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)),
+                                      value)
+
+        return DirectoryResponseList \
+            ((dn, self.response_class(attr_dict))
+                for dn, attr_dict, v in self._fetch
+                    (attr_name, [ value ], attr_list, base_dn))
+
+    #####
+
+    def _lookup_many(self, id_attr, id_list, batch_size=None):
+        '''Look up entries for several identifiers using the snapshot index.'''
+
+        #   Map case-folded identifiers to identifiers as supplied.
+        id_dict = OrderedDict((str(i).lower(), i) for i in id_list)
+
+        result_dict = dict()
+
+        for dn, attr_dict, value in self._fetch \
+                (id_attr, id_dict.keys(), self.attr_list, self.base_dn):
+            result_dict.setdefault(id_dict[value], DirectoryResponseList()) \
+                .append((dn, self.response_class(attr_dict)))
+
+        return result_dict
+
+#####
+
+def _snapshot_filter_error(message):
+    '''
+    Return exception for a filter the directory snapshot can't evaluate,
+    raised as the directory server would raise a bad filter.
+    '''
+    return ldap.FILTER_ERROR({ 'desc' : 'Bad search filter', 'info' : message })
+
+#####
+
+def SnapshotDirectoryConnectionFromConfig(config, **opt_dict):
+    '''
+    Factory method for returning snapshot directory connection specified in
+    a configuration file; the config argument must be a sdg.config.Config
+    object.
+    '''
+
+    #   pylint: disable=W0212
+    opt_dict = config.validate_section \
+                ('DirectorySnapshot',
+                 SnapshotDirectoryConnection._get_valid_option_dict(),
+                 **opt_dict)
+
+    return SnapshotDirectoryConnection(**opt_dict)
+
+#####
+
+def write_directory_snapshot(connection, path, base_dn_list, ldap_filter,
+                             attr_list=None):
+    '''
+    Write entries matching ldap_filter beneath each base DN to a SQLite
+    snapshot at path, indexed by netid, UIN and registry unique ID. The
+    snapshot is built in a temporary file and renamed into place, so
+    readers never see a partial snapshot. Returns number of entries written.
+    '''
+
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    db = sqlite3.connect(temp_path)
+    count = 0
+
+    try:
+        db.executescript \
+            ('''
+            CREATE TABLE entry
+                (id INTEGER PRIMARY KEY, dn TEXT NOT NULL,
+                 attr_data BLOB NOT NULL);
+            CREATE TABLE entry_key
+                (attr TEXT NOT NULL, value TEXT NOT NULL,
+                 entry_id INTEGER NOT NULL);
+            CREATE TABLE snapshot_info
+                (name TEXT PRIMARY KEY, value TEXT);
+            ''')
+
+        for base_dn in base_dn_list:
+            LOGGER.info('writing snapshot of %s', base_dn)
+
+            for dn, entry in connection.iter_lookup \
+                    (ldap_filter, attr_list=attr_list, base_dn=base_dn):
+                #   Store raw attribute dictionary regardless of entry class.
+                if isinstance(entry, DirectoryEntry):
+                    attr_dict = dict((k, list(entry.get_raw(k)))
+                                        for k in entry.keys())
+                else:
+                    attr_dict = dict(entry)
+
+                entry_id = db.execute \
+                    ('INSERT INTO entry (dn, attr_data) VALUES (?, ?)',
+                     (dn.decode('utf-8'), sqlite3.Binary
+                        (cPickle.dumps(attr_dict, cPickle.HIGHEST_PROTOCOL)))
+                    ).lastrowid
+
+                for attr_name, value_list in attr_dict.items():
+                    if attr_name.lower() not in _SNAPSHOT_INDEX_LIST:
+                        continue
+
+                    db.executemany \
+                        ('INSERT INTO entry_key (attr, value, entry_id) '
+                         'VALUES (?, ?, ?)',
+                         [ (attr_name.lower(), v.decode('utf-8').lower(),
+                            entry_id) for v in value_list ])
+
+                count += 1
+
+        #   Index after loading, which is much faster than indexing as
+        #   rows are inserted.
+        db.execute('CREATE INDEX entry_key_idx ON entry_key (attr, value)')
+
+        db.executemany('INSERT INTO snapshot_info (name, value) VALUES (?, ?)',
+                       [ ('created', time.strftime('%Y-%m-%d %H:%M:%S')),
+                         ('filter', ldap_filter),
+                         ('count', str(count)) ])
+        db.commit()
+
+    except:
+        db.close()
+        os.remove(temp_path)
+        raise
+
+    db.close()
+    os.rename(temp_path, path)
+
+    LOGGER.info('wrote %d entries to snapshot %s', count, path)
+    return count
+
+#####
+
+class DirectoryFanout(object):
+    '''
+    Issues the same lookup against several directory connections (for
+    example, an ActiveDirectoryConnection and a CampusLDAPConnection)
+    concurrently, one thread per source. Each source has its own deadline;
+    a source that fails or misses its deadline is reported as such and
+    the results of the remaining sources are still returned.
+    '''
+
+    #####
+
+    def __init__(self, deadline=_FANOUT_DEADLINE_DEFAULT, deadline_dict=None,
+                 **connection_dict):
+        '''
+        Initialize fan-out over named connections, e.g.
+        DirectoryFanout(ad=ad_connection, campus=campus_connection).
+        Sources are merged in sorted name order unless merged() is given an
+        explicit order. The deadline_dict argument overrides the default
+        deadline (in seconds) for individual sources.
+        '''
+
+        if not connection_dict:
+            raise ValueError('no directory connections specified')
+
+        self.connection_dict    = connection_dict
+        self.deadline           = deadline
+        self.deadline_dict      = deadline_dict or dict()
+        return
+
+    #####
+
+    def lookup(self, method_name, *arg_list, **kw_arg_dict):
+        '''
+        Invoke named lookup method with specified arguments on every
+        connection concurrently. Returns DirectoryFanoutResult.
+        '''
+
+        result_queue    = Queue.Queue()
+        start           = time.time()
+
+        def worker(name, connection):
+            '''Perform lookup against one source and queue outcome.'''
+            try:
+                result = getattr(connection, method_name) \
+                            (*arg_list, **kw_arg_dict)
+
+            #   pylint: disable=W0703
+            except Exception, exc:
+                result_queue.put((name, None, exc))
+
+            else:
+                result_queue.put((name, result, None))
+
+        #   Absolute deadline for each source.
+        deadline_dict = dict \
+            ((name, start + self.deadline_dict.get(name, self.deadline))
+                for name in self.connection_dict)
+
+        for name, connection in self.connection_dict.items():
+            thread = threading.Thread(target=worker, args=(name, connection),
+                                      name='DirectoryFanout-%s' % name)
+            thread.daemon = True
+            thread.start()
+
+        fanout_result   = DirectoryFanoutResult()
+        pending_set     = set(self.connection_dict)
+
+        #   Collect outcomes until every source has answered or the latest
+        #   pending deadline passes.
+        while pending_set:
+            remaining = max(deadline_dict[n] for n in pending_set) - time.time()
+
+            if remaining <= 0:
+                break
+
+            try:
+                name, result, exc = result_queue.get(timeout=remaining)
+
+            except Queue.Empty:
+                break
+
+            pending_set.discard(name)
+
+            #   Outcome arrived after its own source's deadline.
+            if time.time() > deadline_dict[name]:
+                fanout_result.timeout_list.append(name)
+
+            elif exc is not None:
+                LOGGER.warning('%s lookup on %s failed: %s', 
+                               method_name, name, exc)
+                fanout_result.error_dict[name] = exc
+
+            else:
+                fanout_result[name] = result
+
+        for name in pending_set:
+            LOGGER.warning('%s lookup on %s missed its deadline',
+                           method_name, name)
+            fanout_result.timeout_list.append(name)
+
+        return fanout_result
+
+    #####
+
+    def lookup_by_netid(self, netid):
+        '''Look up entries by netid in all directories concurrently.'''
+
+        return self.lookup('lookup_by_netid', netid)
+
+#####
+
+class DirectoryFanoutResult(dict):
+    '''
+    Subclass that extends dict class to hold DirectoryFanout results keyed
+    by source name, along with sources that failed or missed deadlines.
+    '''
+
+    #####
+
+    def __init__(self, *arg_list, **kw_arg_dict):
+        super(DirectoryFanoutResult, self).__init__(*arg_list, **kw_arg_dict)
+
+        #   Exceptions raised by failed sources, keyed by source name.
+        self.error_dict     = dict()
+
+        #   Names of sources that missed their deadlines.
+        self.timeout_list   = []
+        return
+
+    #####
+
+    def is_complete(self):
+        '''Return Boolean indicating whether every source answered.'''
+        return not self.error_dict and not self.timeout_list
+
+    #####
+
+    def merged(self, source_order=None):
+        '''
+        Return DirectoryResponseDict combining the first entry from each
+        source that answered. Where sources share an attribute, the value
+        from the source earliest in source_order is used.
+        '''
+
+        if source_order is None:
+            source_order = sorted(self)
+
+        merged_dict = DirectoryResponseDict()
+
+        for name in reversed(list(source_order)):
+            response_list = self.get(name)
+
+            if response_list:
+                dn, entry = response_list[0]
+                merged_dict.update(entry)
+
+        return merged_dict
+
+#####
+
+def _convert_bool(value):
+    '''Convert LDAP Boolean syntax value.'''
+    return value.upper() == u'TRUE'
+
+#####
+
+class DirectoryEntry(object):
+    '''
+    Compact, read-only alternative to DirectoryResponseDict used when the
+    compact_entries option is set. Attribute names are case-insensitive,
+    values are held as tuples of raw byte strings, and each attribute is
+    decoded from UTF-8 (and converted, if a converter is registered in
+    converter_dict) only when first accessed. Values returned by get_bool
+    and get_int are likewise converted once and kept.
+    '''
+
+    __slots__ = ('_raw_dict', '_decoded_dict', '_converted_dict')
+
+    #   Value converters keyed by lower-case attribute name; values without
+    #   a converter are returned as unicode strings. Subclasses may supply
+    #   their own; get_bool and get_int convert on first request instead.
+    converter_dict = dict()
+
+    #####
+
+    def __init__(self, attr_dict=None):
+        '''Initialize from dictionary returned by the ldap module.'''
+
+        object.__setattr__(self, '_raw_dict', dict \
+            ((name.lower(), tuple(value_list))
+                for name, value_list in (attr_dict or dict()).iteritems()))
+        object.__setattr__(self, '_decoded_dict', None)
+        object.__setattr__(self, '_converted_dict', None)
+        return
+
+    #####
+
+    def __contains__(self, attr_name):
+        return attr_name.lower() in self._raw_dict
+
+    #####
+
+    def __getitem__(self, attr_name):
+        '''Return decoded values of specified attribute as list.'''
+        return list(self._decode(attr_name))
+
+    #####
+
+    def __getstate__(self):
+        return self._raw_dict
+
+    #####
+
+    def __iter__(self):
+        return iter(self._raw_dict)
+
+    #####
+
+    def __len__(self):
+        return len(self._raw_dict)
+
+    #####
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._raw_dict)
+
+    #####
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read-only' % self.__class__.__name__)
+
+    #####
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_raw_dict', state)
+        object.__setattr__(self, '_decoded_dict', None)
+        object.__setattr__(self, '_converted_dict', None)
+        return
+
+    #####
+
+    def _decode(self, attr_name):
+        '''Return tuple of decoded values, decoding on first access.'''
+
+        attr_name = attr_name.lower()
+
+        if self._decoded_dict is None:
+            object.__setattr__(self, '_decoded_dict', dict())
+
+        elif attr_name in self._decoded_dict:
+            return self._decoded_dict[attr_name]
+
+        #   Raises KeyError for missing attribute, as a dict would.
+        raw_tuple = self._raw_dict[attr_name]
+
+        value_tuple = tuple(v.decode('utf-8') for v in raw_tuple)
+
+        converter = self.converter_dict.get(attr_name)
+
+        if converter:
+            value_tuple = tuple(converter(v) for v in value_tuple)
+
+        self._decoded_dict[attr_name] = value_tuple
+        return value_tuple
+
+    #####
+
+    def _convert_single(self, attr_name, converter):
+        '''
+        Return single value of attribute passed through converter,
+        converting on first access.
+        '''
+
+        key = (attr_name.lower(), converter)
+
+        if self._converted_dict is None:
+            object.__setattr__(self, '_converted_dict', dict())
+
+        elif key in self._converted_dict:
+            return self._converted_dict[key]
+
+        value = converter(self.get_single(attr_name))
+
+        self._converted_dict[key] = value
+        return value
+
+    #####
+
+    def get(self, attr_name, default=None):
+        '''Return decoded values of specified attribute, or default.'''
+
+        if attr_name.lower() not in self._raw_dict:
+            return default
+
+        return self[attr_name]
+
+    #####
+
+    def get_bool(self, attr_name):
+        '''Return single value from attribute with LDAP Boolean syntax.'''
+        return self._convert_single(attr_name, _convert_bool)
+
+    #####
+
+    def get_int(self, attr_name):
+        '''Return single value from attribute with LDAP Integer syntax.'''
+        return self._convert_single(attr_name, int)
+
+    #####
+
+    def get_multivalue(self, attr_name):
+        '''Return decoded values of specified attribute as list.'''
+        return self[attr_name]
+
+    #####
+
+    def get_raw(self, attr_name):
+        '''Return undecoded values of specified attribute as tuple.'''
+        return self._raw_dict[attr_name.lower()]
+
+    #####
+
+    def get_single(self, attr_name):
+        '''Return single decoded value from attribute.'''
+
+        value_tuple = self._decode(attr_name)
+
+        #   Raise ValueError on attempt to fetch single value from multi-
+        #   valued attribute.
+        if len(value_tuple) > 1:
+            raise ValueError('LDAP attribute %s has >1 value' % attr_name)
+
+        #   Return first (and only) member.
+        return value_tuple[0]
+
+    #####
+
+    def items(self):
+        '''Return list of (attribute name, decoded values) tuples.'''
+        return [ (name, self[name]) for name in self._raw_dict ]
+
+    #####
+
+    def keys(self):
+        '''Return list of lower-case attribute names.'''
+        return self._raw_dict.keys()
 
 #####
 
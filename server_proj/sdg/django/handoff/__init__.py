@@ -9,4 +9,5 @@ Package of SDG functions related to handing off one web application to another
 under Django.
 '''
 
+from _reaper import AnnouncedSessionReaper
 from _wsapi import WSAPI, WSAPIAnnouncer, WSAPIClient, WSAPIServer
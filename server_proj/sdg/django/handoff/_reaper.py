@@ -0,0 +1,107 @@
+#   Copyright (c) 2011 by Jon R. Roma and the Board of Trustees of the
+#   University of Illinois. All rights reserved.
+
+'''
+Background expiry of stale AnnouncedSession rows, used as an in-process
+alternative to running prune_handoff_session from cron.
+'''
+
+import threading
+
+from django.db import connection
+
+from sdg import log
+
+from sdg.django.handoff.models import AnnouncedSession, \
+    _EXPIRE_BUDGET_DEFAULT, _EXPIRE_SECONDS_DEFAULT
+
+#   Initialize module logger.
+LOGGER = log.init_module_logger()
+
+_INTERVAL_DEFAULT       = 60        # Default seconds between reaper ticks.
+
+#####
+
+class AnnouncedSessionReaper(threading.Thread):
+    '''
+    Daemon thread that periodically expires completed and stale
+    AnnouncedSession rows, deleting no more than budget rows per tick.
+    '''
+
+    #   Reaper started by start_once(), if any.
+    _instance       = None
+    _instance_lock  = threading.Lock()
+
+    #####
+
+    def __init__(self, interval=_INTERVAL_DEFAULT,
+                 budget=_EXPIRE_BUDGET_DEFAULT,
+                 seconds=_EXPIRE_SECONDS_DEFAULT):
+        super(AnnouncedSessionReaper, self).__init__\
+            (name='AnnouncedSessionReaper')
+
+        #   Don't keep process alive on account of this thread.
+        self.daemon     = True
+
+        self.budget     = budget
+        self.interval   = interval
+        self.seconds    = seconds
+
+        self._stop_event = threading.Event()
+        return None
+
+    #####
+
+    @classmethod
+    def start_once(cls, **kw_arg_dict):
+        '''
+        Start a single process-wide reaper; subsequent calls return the
+        reaper already running.
+        '''
+
+        with cls._instance_lock:
+            if cls._instance is None or not cls._instance.is_alive():
+                cls._instance = cls(**kw_arg_dict)
+                cls._instance.start()
+
+        return cls._instance
+
+    #####
+
+    def run(self):
+        '''Expire rows once per interval until stopped.'''
+
+        LOGGER.debug('%s: started (interval %ds, budget %d)',
+                     self.name, self.interval, self.budget)
+
+        while not self._stop_event.wait(self.interval):
+            self.tick()
+
+        return
+
+    #####
+
+    def stop(self):
+        '''Ask reaper to exit after its current tick.'''
+
+        self._stop_event.set()
+        return
+
+    #####
+
+    def tick(self):
+        '''Perform one bounded expiry pass; never raises.'''
+
+        try:
+            return AnnouncedSession.expire(seconds=self.seconds,
+                                           budget=self.budget)
+
+        #   pylint: disable=W0703
+        except Exception:
+            log.log_exception('%s: expiry failed' % self.name)
+            return 0
+
+        finally:
+            #   Django connections are per thread; don't hold one open
+            #   between ticks.
+            connection.close()
@@ -18,12 +18,17 @@ import logging
 
 from sdg import standard_path
 
+import errno
 import hmac
+import random
 import simplejson as json
+import socket
 import sys
+import threading
 import types
 
-from httplib import HTTPConnection, HTTPSConnection
+from httplib import BadStatusLine, HTTPConnection, HTTPException, \
+    HTTPSConnection
 from types import DictType
 from urlparse import urlparse, urlunparse
 
@@ -33,11 +38,107 @@ from django.http import HttpResponse
 from sdg import hexdigest
 from sdg import log
 
-from sdg.django.handoff.models import AnnouncedSession
+from sdg.django.handoff.models import AnnouncedSession, \
+    _EXPIRE_BUDGET_DEFAULT
 
 #   Initialize module logger.
 LOGGER = log.init_module_logger()
 
+_CONNECT_TIMEOUT_DEFAULT    = 10    # Default seconds to establish connection.
+_READ_TIMEOUT_DEFAULT       = 30    # Default seconds to wait on each read.
+_POOL_IDLE_MAX              = 4     # Idle connections kept per netloc.
+_RETRIEVE_MANY_MAX          = 100   # Most sessions per retrieve_many call.
+
+_PASSTHROUGH_FLAG           = '1'   # Value of passthrough request key.
+
+#####
+
+class _ConnectionPool(object):
+    '''
+    Thread-safe pool of idle keep-alive HTTP/HTTPS connections, keyed by
+    URL scheme and netloc. Used by WSAPIClient.
+    '''
+
+    #####
+
+    def __init__(self, idle_max=_POOL_IDLE_MAX):
+        self.idle_max   = idle_max
+
+        self._idle_dict = dict()
+        self._lock      = threading.Lock()
+        return None
+
+    #####
+
+    def checkin(self, scheme, netloc, conn):
+        '''Return connection to pool, closing it if pool is full.'''
+
+        with self._lock:
+            idle_list = self._idle_dict.setdefault((scheme, netloc), [])
+
+            if len(idle_list) < self.idle_max:
+                idle_list.append(conn)
+                return None
+
+        conn.close()
+        return None
+
+    #####
+
+    def checkout(self, scheme, netloc, connect_timeout, read_timeout,
+                 reuse=True):
+        '''
+        Return 2-tuple of connection and Boolean indicating whether it was
+        reused from the pool. New connections are established immediately
+        so that connect_timeout applies to connection setup only. If reuse
+        is false, a new connection is always established.
+        '''
+
+        conn = None
+
+        if reuse:
+            with self._lock:
+                idle_list = self._idle_dict.get((scheme, netloc))
+                conn = idle_list.pop() if idle_list else None
+
+        if conn is not None:
+            conn.sock.settimeout(read_timeout)
+            return conn, True
+
+        #   Determine which URL scheme to instantiate.
+        if scheme == 'http':
+            http_class = HTTPConnection
+
+        else:
+            http_class = HTTPSConnection
+
+        conn = http_class(netloc, timeout=connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(read_timeout)
+        return conn, False
+
+#   Connections shared by all WSAPIClient instances in this process.
+_CONNECTION_POOL = _ConnectionPool()
+
+#####
+
+def _is_stale_connection_error(x):
+    '''
+    Return True if exception x shows that a pooled connection had been
+    closed by the server before any of the response arrived, so that the
+    request can safely be sent again. Timeouts and other errors are not
+    retried, as the server may already have processed the request.
+    '''
+
+    if isinstance(x, BadStatusLine):
+        return x.line in ('', "''") or \
+            x.line.startswith('No status line received')
+
+    if isinstance(x, socket.timeout):
+        return False
+
+    return isinstance(x, socket.error) and x.errno == errno.ECONNRESET
+
 #####
 
 class WSAPI(object):
@@ -188,11 +289,26 @@ class WSAPIAnnouncer(WSAPI):
 
         application_id = kw_arg_dict.pop('application_id')
 
+        #   Fraction of announce calls that also expire stale sessions, and
+        #   maximum number of rows each such call may delete. Opportunistic
+        #   expiry is disabled by default.
+        expire_rate     = kw_arg_dict.pop('expire_rate', 0.0)
+        expire_budget   = kw_arg_dict.pop('expire_budget', 
+                                          _EXPIRE_BUDGET_DEFAULT)
+
+        #   Minimum size (in bytes) of encoded user data to be stored
+        #   compressed; compression is disabled by default.
+        compress_threshold = kw_arg_dict.pop('compress_threshold', None)
+
         super(WSAPIAnnouncer, self).__init__(**kw_arg_dict)
 
         #   Save application ID.
         self.application_id     = application_id
 
+        self.compress_threshold = compress_threshold
+        self.expire_budget      = expire_budget
+        self.expire_rate        = expire_rate
+
         #   Generate private and public key pair.
         self.session_private    = hexdigest.generate_hexdigest()
         self.session_public     = self._hash_with_service_secret \
@@ -216,9 +332,12 @@ class WSAPIAnnouncer(WSAPI):
             application_id=self.application_id,
             session_private=self.session_private,
             session_public=self.session_public,
-            user_data=WSAPI.encode(user_data)
             )
 
+        announced_session.set_user_data_encoded \
+            (WSAPI.encode(user_data),
+             compress_threshold=self.compress_threshold)
+
         #   Commit model.
         announced_session.save()
 
@@ -228,6 +347,25 @@ class WSAPIAnnouncer(WSAPI):
 
         logging.debug('%s: announce: session public: %s (%s)' % \
                       (self.classname(), self.session_public, dkey))
+
+        #   Occasionally expire stale sessions on behalf of everyone.
+        if self.expire_rate and random.random() < self.expire_rate:
+            self._expire()
+
+        return None
+
+    #####
+
+    def _expire(self):
+        '''Expire stale sessions; failure must not break announcement.'''
+
+        try:
+            AnnouncedSession.expire(budget=self.expire_budget)
+
+        #   pylint: disable=W0703
+        except Exception:
+            log.log_exception('%s: expiry failed' % self.classname())
+
         return None
 
 #####
@@ -243,11 +381,21 @@ class WSAPIClient(WSAPI):
         #   Extract application id and call superclass constructor.
         application_id = kw_arg_dict.pop('application_id')
 
+        #   Extract timeouts (in seconds) for establishing connection and
+        #   for each subsequent socket read.
+        connect_timeout = kw_arg_dict.pop('connect_timeout',
+                                          _CONNECT_TIMEOUT_DEFAULT)
+        read_timeout    = kw_arg_dict.pop('read_timeout',
+                                          _READ_TIMEOUT_DEFAULT)
+
         super(WSAPIClient, self).__init__(**kw_arg_dict)
 
         #   Save application ID.
         self.application_id     = application_id
 
+        self.connect_timeout    = connect_timeout
+        self.read_timeout       = read_timeout
+
         return None
 
     #####
@@ -260,8 +408,18 @@ class WSAPIClient(WSAPI):
         if not isinstance(resp_body, DictType) or 'exception' not in resp_body:
             return
 
+        raise self._make_exception(method_name, resp_body['exception'])
+
+    #####
+
+    def _make_exception(self, method_name, exc_tuple):
+        '''
+        Called by client to construct exception object from exception tuple
+        returned by server.
+        '''
+
         #   Extract components from exception tuple.
-        name, message, arg_list = resp_body['exception'][:]
+        name, message, arg_list = exc_tuple[:]
 
         import exceptions
 
@@ -284,27 +442,27 @@ class WSAPIClient(WSAPI):
             logging.error('%s: method \'%s\' exception: %s' % \
                           (self.classname(), method_name, name))
 
-            #   If arguments supplied, use them while raising exception.
+            #   If arguments supplied, use them while constructing exception.
             if len(arg_list):
-                raise exc_class(arg_list)
+                return exc_class(arg_list)
 
-            #   Otherwise, use [possibly-empty] message while raising exception.
+            #   Otherwise, use [possibly-empty] message.
             else:
-                raise exc_class(message)
+                return exc_class(message)
             
         #   Couldn't identify exception
         logging.error('%s: unidentified exception from server: %s (%s)' % \
                       (self.classname(), name, 
                        str(arg_list) if len(arg_list) else message))
-        raise Exception('Unidentified exception from server')
+        return Exception('Unidentified exception from server')
 
     #####
     
     def _recv_raw_response(self, url, method_name, req_body):
         '''Called by client to make HTTP POST request and process response.'''
 
-        logging.debug('%s: method \'%s\' request: %s' % \
-                      (self.classname(), method_name, str(req_body)))
+        logging.debug('%s: method \'%s\' request: %s',
+                      self.classname(), method_name, req_body)
 
         #   Parse URL and extract netloc and path.
 
@@ -324,41 +482,69 @@ class WSAPIClient(WSAPI):
         #   Encode verification hash and request body.
         request_data = WSAPI.encode((req_vfy, req_body))
 
-        #   Determine which URL scheme to instantiate.
-        if url_parsed.scheme == 'http':
-            http_class = HTTPConnection
+        #   Check out a connection and issue HTTP POST request. A pooled
+        #   connection may have been closed by the server while idle; if
+        #   so, retry exactly once on a fresh connection.
+        reuse = True
+
+        while True:
+            conn, is_reused = _CONNECTION_POOL.checkout \
+                                (url_parsed.scheme, netloc,
+                                 self.connect_timeout, self.read_timeout,
+                                 reuse=reuse)
+            try:
+                conn.request('POST', path, request_data, header_dict)
+
+                #   Get HTTP response.
+                resp = conn.getresponse()
+
+            except (HTTPException, socket.error), x:
+                conn.close()
+
+                if is_reused and _is_stale_connection_error(x):
+                    logging.debug('%s: stale connection to %s; reconnecting',
+                                  self.classname(), netloc)
+                    reuse = False
+                    continue
+
+                raise
+
+            break
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            url_unparsed = urlunparse \
+                                ((url_parsed.scheme, netloc, path,
+                                  '', '', ''))
+            logging.debug('%s: HTTP request (POST): \'%s\' data: %s',
+                          self.classname(), url_unparsed, request_data)
+    
+        logging.debug('%s: HTTP response: %s %s',
+                      self.classname(), resp.status, resp.reason)
 
-        else:
-            http_class = HTTPSConnection
+        #   Read entire response so the connection can be reused, then
+        #   return connection to pool unless server is closing it.
+        try:
+            resp_raw = resp.read()
 
-        #   Make connection and issue HTTP POST request.
-        conn = http_class(url_parsed.netloc)
-    
-        conn.request('POST', path, request_data, header_dict)
+        except (HTTPException, socket.error):
+            conn.close()
+            raise
 
-        url_unparsed = urlunparse \
-                            ((url_parsed.scheme, url_parsed.netloc, path,
-                              '', '', ''))
-        logging.debug('%s: HTTP request (POST): \'%s\' data: %s' % \
-                      (self.classname(), url_unparsed, request_data))
-    
-        #   Get HTTP response.
-        resp = conn.getresponse()
+        if resp.will_close:
+            conn.close()
 
-        logging.debug('%s: HTTP response: %s %s' % \
-                      (self.classname(), resp.status, resp.reason))
+        else:
+            _CONNECTION_POOL.checkin(url_parsed.scheme, netloc, conn)
 
         #   Raise exception if request failed.
         if resp.status != 200:
-            logging.debug(resp.read())
+            logging.debug(resp_raw)
             raise Exception(resp.reason)
 
         #   Raise exception if incorrect content type.
         if resp.getheader('Content-type') != WSAPI._ENCODED_MIME_TYPE:
             raise Exception('incorrect content type')
 
-        #   Read response data and decode into Python object.
-        resp_raw = resp.read()
         return resp_raw
 
     #####
@@ -380,15 +566,19 @@ class WSAPIClient(WSAPI):
         #   and contains key named 'exception',
         self._check_response(method_name, resp_body)
 
-        logging.debug('%s: method \'%s\' response: %s' % \
-                      (self.classname(), method_name, str(resp_body)))
+        logging.debug('%s: method \'%s\' response: %s',
+                      self.classname(), method_name, resp_body)
 
         return resp_body
 
     #####
     
-    def retrieve(self, url, session_public):
-        '''Called by client to retrieve data for announced session'''
+    def retrieve(self, url, session_public, passthrough=False):
+        '''
+        Called by client to retrieve data for announced session. If
+        passthrough is true, server returns user data exactly as stored,
+        still encoded, and it is decoded here instead.
+        '''
 
         req_body = \
             {
@@ -396,6 +586,11 @@ class WSAPIClient(WSAPI):
             'session_public'    : session_public,
             }
 
+        #   Flag is sent as a string, since the request body is flattened
+        #   into the verification hash.
+        if passthrough:
+            req_body['passthrough'] = _PASSTHROUGH_FLAG
+
         session_private, user_data = self._request(url, 'retrieve', req_body)
 
         #   Recompute public key to verify response; raise exception on
@@ -403,7 +598,87 @@ class WSAPIClient(WSAPI):
         if session_public != self._hash_with_service_secret(session_private):
             raise WSAPI.KeyIntegrityError
 
+        if passthrough:
+            return WSAPI.decode(user_data)
+
         return user_data
+
+    #####
+    
+    def retrieve_many(self, url, session_public_list, passthrough=False):
+        '''
+        Called by client to retrieve data for several announced sessions in
+        a single request. Returns dictionary keyed by session_public whose
+        values are either user data or the WSAPIError raised for that
+        session; each result is verified independently. The passthrough
+        argument behaves as it does for retrieve. Since the server accepts
+        at most _RETRIEVE_MANY_MAX sessions per request, longer lists are
+        retrieved in several requests.
+        '''
+
+        session_public_list = list(session_public_list)
+
+        result_dict = dict()
+
+        for i in range(0, len(session_public_list), _RETRIEVE_MANY_MAX):
+            result_dict.update(self._retrieve_many_chunk \
+                (url, session_public_list[i:i + _RETRIEVE_MANY_MAX],
+                 passthrough))
+
+        return result_dict
+
+    #####
+
+    def _retrieve_many_chunk(self, url, session_public_list, passthrough):
+        '''
+        Retrieve data for at most _RETRIEVE_MANY_MAX sessions in a single
+        request; called by retrieve_many.
+        '''
+
+        req_body = \
+            {
+            'application_id'        : self.application_id,
+            'session_public_list'   : session_public_list,
+            }
+
+        #   Flag is sent as a string, since the request body is flattened
+        #   into the verification hash.
+        if passthrough:
+            req_body['passthrough'] = _PASSTHROUGH_FLAG
+
+        resp_body = self._request(url, 'retrieve_many', req_body)
+
+        result_dict = dict()
+
+        for session_public in session_public_list:
+            resp_item = resp_body.get(session_public)
+
+            #   Server omitted result for this session.
+            if resp_item is None:
+                result_dict[session_public] = WSAPI.ProtocolError \
+                    ('no result for session_public: %s' % session_public)
+                continue
+
+            #   Server reported exception for this session.
+            if isinstance(resp_item, DictType):
+                result_dict[session_public] = self._make_exception \
+                    ('retrieve_many', resp_item['exception'])
+                continue
+
+            session_private, user_data = resp_item[:]
+
+            #   Recompute public key to verify this session's result.
+            if session_public != \
+                    self._hash_with_service_secret(session_private):
+                result_dict[session_public] = WSAPI.KeyIntegrityError()
+                continue
+
+            if passthrough:
+                user_data = WSAPI.decode(user_data)
+
+            result_dict[session_public] = user_data
+
+        return result_dict
 
 #####
 
@@ -444,6 +719,8 @@ class WSAPIServer(WSAPI):
         #   keys are present.
         application_id = req_dict.pop('application_id')
         session_public = req_dict.pop('session_public')
+        passthrough    = req_dict.pop('passthrough', None) == \
+            _PASSTHROUGH_FLAG
         
         if len(req_dict):
             raise WSAPI.ProtocolError \
@@ -462,22 +739,123 @@ class WSAPIServer(WSAPI):
                 ('no session with session_public: %s' % session_public)
     
         #   Flag session as completed so subsequent callers can't retrieve it.
-        a_session.is_completed = True
-        a_session.save()
+        #   Only that column is written; user data isn't saved back.
+        if not AnnouncedSession.objects.filter \
+                    (pk=a_session.pk, is_completed=False) \
+                    .update(is_completed=True):
+            raise WSAPI.UnknownSessionError \
+                ('no session with session_public: %s' % session_public)
+
+        #   Result consists of session private key and user data from
+        #   database.
+        return a_session.session_private, \
+            WSAPIServer._user_data_result(a_session, passthrough)
+
+    #####
+
+    @transaction.commit_on_success
+    def _handle_retrieve_many(self, req_dict):
+        #   Determine whether required dictionary keys are present.
+        if 'application_id' not in req_dict or \
+                'session_public_list' not in req_dict:
+            raise WSAPI.ProtocolError \
+                ('application_id or session_public_list keys not specified')
+
+        #   Extract required dictionary keys and raise exception if extraneous
+        #   keys are present.
+        application_id      = req_dict.pop('application_id')
+        session_public_list = req_dict.pop('session_public_list')
+        passthrough         = req_dict.pop('passthrough', None) == \
+            _PASSTHROUGH_FLAG
+        
+        if len(req_dict):
+            raise WSAPI.ProtocolError \
+                ('extraneous keys present: %s' % ', '.join(req_dict))
+
+        if not isinstance(session_public_list, types.ListType):
+            raise WSAPI.ProtocolError('session_public_list must be a list')
+
+        if len(session_public_list) > _RETRIEVE_MANY_MAX:
+            raise WSAPI.ProtocolError \
+                ('too many sessions requested (%d); maximum is %d' % 
+                 (len(session_public_list), _RETRIEVE_MANY_MAX))
+
+        #   Fetch all matching AnnouncedSession objects in one query.
+        a_session_dict = dict \
+            ((a_session.session_public, a_session)
+                for a_session in AnnouncedSession.objects.filter
+                    (application_id=application_id,
+                     session_public__in=session_public_list,
+                     is_completed=False))
+
+        #   Flag each session as completed so subsequent callers can't
+        #   retrieve it. As with retrieve, the update is conditional, so a
+        #   session claimed by a concurrent caller since it was fetched is
+        #   treated as unknown rather than returned twice.
+        for session_public, a_session in a_session_dict.items():
+            if not AnnouncedSession.objects.filter \
+                        (pk=a_session.pk, is_completed=False) \
+                        .update(is_completed=True):
+                del a_session_dict[session_public]
+
+        #   Result for each session is either the same 2-tuple returned by
+        #   retrieve, or an exception object for that session alone.
+        result_dict = dict()
+
+        for session_public in session_public_list:
+            a_session = a_session_dict.get(session_public)
+
+            if a_session is None:
+                result_dict[session_public] = WSAPIServer._exception_dict \
+                    (WSAPI.UnknownSessionError
+                        ('no session with session_public: %s' % 
+                         session_public))
+                continue
+
+            result_dict[session_public] = \
+                (a_session.session_private,
+                 WSAPIServer._user_data_result(a_session, passthrough))
 
-        #   Result consists of session private key and decoded user data
-        #   from database.
-        return a_session.session_private, WSAPI.decode(a_session.user_data)
+        return result_dict
 
     #####
     
     _method_dict = \
         {
         'retrieve'      : _handle_retrieve,
+        'retrieve_many' : _handle_retrieve_many,
         }
 
     #####
 
+    @staticmethod
+    def _user_data_result(a_session, passthrough):
+        '''
+        Return user data for response. When passthrough is requested, the
+        stored encoded form is returned as is rather than being decoded
+        here only to be re-encoded into the response.
+        '''
+
+        user_data = a_session.get_user_data_encoded()
+
+        if passthrough:
+            return user_data
+
+        return WSAPI.decode(user_data)
+
+    #####
+
+    @staticmethod
+    def _exception_dict(x):
+        '''Build exception object for response.'''
+
+        return \
+            {
+            'exception' : (x.__class__.__name__, x.message, x.args)
+            }
+
+    #####
+
     def serve(self, request, method_name):
         '''Handle request to server.'''
 
@@ -502,14 +880,14 @@ class WSAPIServer(WSAPI):
             #   Get handler object for specified method.
             method = WSAPIServer._method_dict[method_name]
 
-            logging.debug('%s: method \'%s\' request: %s' % \
-                          (self.classname(), method_name, str(req_body)))
+            logging.debug('%s: method \'%s\' request: %s',
+                          self.classname(), method_name, req_body)
 
             #   Invoke method.
             resp_body = method(self, req_body)
 
-            logging.debug('%s: method \'%s\' response: %s' % \
-                          (self.classname(), method_name, str(resp_body)))
+            logging.debug('%s: method \'%s\' response: %s',
+                          self.classname(), method_name, resp_body)
 
         #   If WSAPIError encountered, build exception object for response.
         except WSAPI.WSAPIError, x:
@@ -517,10 +895,7 @@ class WSAPIServer(WSAPI):
                           (self.classname(), method_name,
                            x.__class__.__name__))
             #   Build exception object and fall through.
-            resp_body = \
-                {
-                'exception' : (x.__class__.__name__, x.message, x.args)
-                }
+            resp_body = WSAPIServer._exception_dict(x)
 
         #   Other exceptions are logged and re-raised.
         except Exception, x:
@@ -10,11 +10,19 @@ off to a remote application for further processing. Remote application uses
 handoff API to retrieve data stored here.
 """
 
+import base64
 import logging
+import zlib
 
 from datetime import datetime, timedelta
 
 from django.db import models
+from django.db.models import Q
+
+_COMPRESSED_PREFIX      = 'zlib:'   # Marks compressed user_data.
+
+_EXPIRE_BUDGET_DEFAULT  = 100       # Default rows deleted per expiry pass.
+_EXPIRE_SECONDS_DEFAULT = 86400     # Default age for expiry of open sessions.
 
 _PRUNE_DAYS_DEFAULT     = 7         # Default age for pruning.
 _PRUNE_DAYS_MINIMUM     = 1         # Minimum age for pruning.
@@ -52,6 +60,70 @@ class AnnouncedSession(models.Model):
 
     #####
 
+    def get_user_data_encoded(self):
+        '''
+        Return user data in the encoded form in which it was announced,
+        decompressing it if necessary. Does not decode it.
+        '''
+
+        user_data = self.user_data
+
+        if user_data and user_data.startswith(_COMPRESSED_PREFIX):
+            return zlib.decompress \
+                (base64.b64decode(user_data[len(_COMPRESSED_PREFIX):]))
+
+        return user_data
+
+    #####
+
+    def set_user_data_encoded(self, user_data, compress_threshold=None):
+        '''
+        Store already-encoded user data. If compress_threshold is specified,
+        data at least that long is stored compressed when that is smaller.
+        '''
+
+        if compress_threshold is not None and user_data and \
+                len(user_data) >= compress_threshold:
+            #   Compressed data is stored base64-encoded since column is text.
+            compressed = _COMPRESSED_PREFIX + \
+                base64.b64encode(zlib.compress(user_data))
+
+            if len(compressed) < len(user_data):
+                user_data = compressed
+
+        self.user_data = user_data
+        return
+
+    #####
+
+    @classmethod
+    def expire(cls, seconds=_EXPIRE_SECONDS_DEFAULT,
+               budget=_EXPIRE_BUDGET_DEFAULT):
+        '''
+        Incrementally discard completed rows and rows older than specified
+        age. No more than budget rows are deleted per call, so the cost to
+        the caller is bounded; returns number of rows deleted.
+        '''
+
+        #   Compute compare_dt based on current time and desired delta.
+        compare_dt = datetime.now() - timedelta(seconds=abs(seconds))
+
+        #   Collect primary keys of at most budget expired rows. Completed
+        #   sessions can never be retrieved again, so they go regardless of
+        #   age.
+        #   pylint: disable=E1101
+        pk_list = list(cls.objects.filter
+                        (Q(is_completed=True) | Q(create_dt__lt=compare_dt))
+                        .values_list('pk', flat=True)[:budget])
+
+        if pk_list:
+            cls.objects.filter(pk__in=pk_list).delete()
+            logging.debug('expired %d %s rows', len(pk_list), cls.__name__)
+
+        return len(pk_list)
+
+    #####
+
     @classmethod
     def prune(cls, days=_PRUNE_DAYS_DEFAULT):
         '''
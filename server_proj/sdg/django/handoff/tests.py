@@ -0,0 +1,171 @@
+#   Copyright (c) 2011 by Jon R. Roma and the Board of Trustees of the
+#   University of Illinois. All rights reserved.
+
+'''
+Tests of the session handoff API. Client requests are passed straight to
+the server's serve method, so requests and responses make the same round
+trip, including verification hashes, as they do over HTTP.
+'''
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from sdg.hexdigest import generate_hexdigest, write_hexdigest
+
+from sdg.django.handoff import WSAPI, WSAPIAnnouncer, WSAPIClient, \
+    WSAPIServer
+from sdg.django.handoff._wsapi import _RETRIEVE_MANY_MAX
+
+_APPLICATION_ID = 'test'
+_URL            = 'http://handoff.invalid/handoff/'
+
+#####
+
+class _FakeRequest(object):
+    '''Minimal stand-in for Django request; announce only uses session.'''
+
+    def __init__(self):
+        self.session = dict()
+
+#####
+
+class _LoopbackClient(WSAPIClient):
+    '''Client whose requests are served in-process by a WSAPIServer.'''
+
+    def __init__(self, **kw_arg_dict):
+        super(_LoopbackClient, self).__init__(**kw_arg_dict)
+
+        self.server = WSAPIServer \
+                        (service_secret_path=self.service_secret_path)
+        self.request_count = 0
+        return None
+
+    #####
+
+    def _recv_raw_response(self, url, method_name, req_body):
+        self.request_count += 1
+
+        req_vfy = self._generate_verification_hash(req_body)
+
+        request = RequestFactory().post \
+                    ('/handoff/%s/' % method_name,
+                     data=WSAPI.encode((req_vfy, req_body)),
+                     content_type=WSAPI._ENCODED_MIME_TYPE)
+
+        return self.server.serve(request, method_name)
+
+#####
+
+class HandoffRoundTripTest(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='handoff_test.')
+        self.service_secret_path = os.path.join(self.work_dir,
+                                                'service_secret')
+
+        write_hexdigest(generate_hexdigest(),
+                        path_random=self.service_secret_path,
+                        description='handoff tests (throwaway)')
+
+        self.client = _LoopbackClient \
+                        (application_id=_APPLICATION_ID,
+                         service_secret_path=self.service_secret_path)
+        return None
+
+    #####
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return None
+
+    #####
+
+    def _announce(self, user_data, compress_threshold=None):
+        '''Announce session; return its public key.'''
+
+        announcer = WSAPIAnnouncer \
+                        (application_id=_APPLICATION_ID,
+                         service_secret_path=self.service_secret_path,
+                         compress_threshold=compress_threshold)
+        announcer.announce(request=_FakeRequest(), user_data=user_data)
+
+        return announcer.session_public
+
+    #####
+
+    def test_retrieve(self):
+        user_data = { 'uid' : 'user', 'groups' : [ 'a', 'b' ] }
+        session_public = self._announce(user_data)
+
+        self.assertEqual(self.client.retrieve(_URL, session_public),
+                         user_data)
+
+        #   Sessions can be retrieved only once.
+        self.assertRaises(WSAPI.UnknownSessionError,
+                          self.client.retrieve, _URL, session_public)
+
+    #####
+
+    def test_retrieve_passthrough(self):
+        user_data = { 'uid' : 'user', 'payload' : 'x' * 1000 }
+
+        for compress_threshold in (None, 100):
+            session_public = self._announce \
+                                (user_data,
+                                 compress_threshold=compress_threshold)
+
+            self.assertEqual(self.client.retrieve
+                                (_URL, session_public, passthrough=True),
+                             user_data)
+
+    #####
+
+    def test_retrieve_many(self):
+        user_data_list = [ { 'uid' : 'user%d' % i } for i in range(3) ]
+        session_public_list = [ self._announce(user_data)
+                                    for user_data in user_data_list ]
+
+        for passthrough in (False, True):
+            result_dict = self.client.retrieve_many \
+                            (_URL, session_public_list[:2] + [ 'unknown' ],
+                             passthrough=passthrough)
+
+            if not passthrough:
+                self.assertEqual(result_dict[session_public_list[0]],
+                                 user_data_list[0])
+                self.assertEqual(result_dict[session_public_list[1]],
+                                 user_data_list[1])
+
+            #   Sessions already retrieved are unknown the second time.
+            else:
+                self.assertTrue(isinstance
+                                    (result_dict[session_public_list[0]],
+                                     WSAPI.UnknownSessionError))
+
+            self.assertTrue(isinstance(result_dict['unknown'],
+                                       WSAPI.UnknownSessionError))
+
+        result_dict = self.client.retrieve_many \
+                        (_URL, session_public_list[2:], passthrough=True)
+
+        self.assertEqual(result_dict[session_public_list[2]],
+                         user_data_list[2])
+
+    #####
+
+    def test_retrieve_many_chunked(self):
+        user_data_list = [ { 'uid' : 'user%d' % i }
+                           for i in range(_RETRIEVE_MANY_MAX + 1) ]
+        session_public_list = [ self._announce(user_data)
+                                    for user_data in user_data_list ]
+
+        result_dict = self.client.retrieve_many(_URL, session_public_list)
+
+        self.assertEqual(self.client.request_count, 2)
+        self.assertEqual([ result_dict[session_public]
+                           for session_public in session_public_list ],
+                         user_data_list)
@@ -0,0 +1,504 @@
+#   Copyright (c) 2011, 2012 by Jon R. Roma and the Board of Trustees of the
+#   University of Illinois. All rights reserved.
+
+'''
+In-process stand-in for an LDAP server, used to test and benchmark
+sdg.directory without access to a campus directory. FakeLDAPObject
+implements the subset of the python-ldap LDAPObject interface used by
+sdg.directory against a FakeDirectory of synthetic entries; install it
+by assigning it to sdg.directory.LDAP_OBJECT_CLASS.
+'''
+
+from __future__ import absolute_import
+
+import hashlib
+import itertools
+import ldap
+import threading
+import time
+
+from ldap.controls import SimplePagedResultsControl
+
+from sdg import log
+
+#   Initialize module logger.
+LOGGER = log.init_module_logger()
+
+#####
+
+class FilterSyntaxError(Exception):
+    '''Exception raised when LDAP filter can't be parsed.'''
+    pass
+
+#####
+
+def _unescape(value):
+    '''Undo filter escaping (e.g. \\2a) of assertion value.'''
+
+    part_list = value.split('\\')
+    result = part_list[0]
+
+    for part in part_list[1:]:
+        result += chr(int(part[:2], 16)) + part[2:]
+
+    return result
+
+#####
+
+def parse_filter(ldap_filter):
+    '''
+    Parse LDAP filter string into a predicate taking an attribute
+    dictionary with lowercase names and values. Supports &, |, !,
+    equality, presence and substring assertions.
+
+    Where the filter can only match entries having one of a known set of
+    attribute values, the predicate's key_list attribute lists them as
+    (name, value) tuples, so that callers can consult an index instead of
+    evaluating every entry; otherwise key_list is None.
+    '''
+
+    ldap_filter = ldap_filter.strip()
+
+    #   Bare assertion, e.g. uiucEduNetID=jdoe, as accepted by servers.
+    if not ldap_filter.startswith('('):
+        ldap_filter = '(%s)' % ldap_filter
+
+    predicate, end = _parse(ldap_filter, 0)
+
+    if end != len(ldap_filter):
+        raise FilterSyntaxError('trailing text in filter: %s' % ldap_filter)
+
+    return predicate
+
+#####
+
+def _parse(text, pos):
+    '''Parse filter beginning at pos; return predicate and end position.'''
+
+    if text[pos:pos + 1] != '(':
+        raise FilterSyntaxError('expected ( at %d in %s' % (pos, text))
+
+    pos += 1
+    operator = text[pos:pos + 1]
+
+    if operator in ('&', '|', '!'):
+        pos += 1
+        child_list = []
+
+        while text[pos:pos + 1] == '(':
+            child, pos = _parse(text, pos)
+            child_list.append(child)
+
+        if text[pos:pos + 1] != ')':
+            raise FilterSyntaxError('expected ) at %d in %s' % (pos, text))
+
+        key_list = None
+
+        if operator == '&':
+            predicate = lambda e: all(c(e) for c in child_list)
+
+            #   Any indexable conjunct narrows candidates.
+            for child in child_list:
+                if child.key_list is not None:
+                    key_list = child.key_list
+                    break
+
+        elif operator == '|':
+            predicate = lambda e: any(c(e) for c in child_list)
+
+            #   Indexable only if every disjunct is.
+            if all(c.key_list is not None for c in child_list):
+                key_list = sum((c.key_list for c in child_list), [])
+
+        else:
+            if len(child_list) != 1:
+                raise FilterSyntaxError('! takes one filter in %s' % text)
+            predicate = lambda e: not child_list[0](e)
+
+        predicate.key_list = key_list
+        return predicate, pos + 1
+
+    end = text.find(')', pos)
+
+    if end < 0:
+        raise FilterSyntaxError('unterminated assertion in %s' % text)
+
+    attr_name, sep, value = text[pos:end].partition('=')
+
+    if not sep:
+        raise FilterSyntaxError('expected = in %s' % text[pos:end])
+
+    attr_name = attr_name.lower()
+    key_list = None
+
+    #   Presence assertion.
+    if value == '*':
+        predicate = lambda e: bool(e.get(attr_name))
+
+    #   Substring assertion.
+    elif '*' in value:
+        part_list = [ _unescape(p).lower() for p in value.split('*') ]
+
+        def predicate(entry):
+            '''Match substring assertion against any value.'''
+            for candidate in entry.get(attr_name, ()):
+                if not candidate.startswith(part_list[0]) or \
+                        not candidate.endswith(part_list[-1]):
+                    continue
+
+                index = len(part_list[0])
+
+                for part in part_list[1:-1]:
+                    index = candidate.find(part, index)
+                    if index < 0:
+                        break
+                    index += len(part)
+
+                else:
+                    if index <= len(candidate) - len(part_list[-1]):
+                        return True
+
+            return False
+
+    #   Equality assertion.
+    else:
+        value = _unescape(value).lower()
+        predicate = lambda e: value in e.get(attr_name, ())
+        key_list = [ (attr_name, value) ]
+
+    predicate.key_list = key_list
+    return predicate, end + 1
+
+#####
+
+class FakeDirectory(object):
+    '''
+    Set of directory entries served by FakeLDAPObject, with optional
+    simulated latency (in seconds) for connecting, binding and searching.
+    '''
+
+    #   Directories keyed by URI.
+    _directory_dict         = dict()
+    _directory_dict_lock    = threading.Lock()
+
+    #####
+
+    def __init__(self, connect_delay=0.0, bind_delay=0.0, search_delay=0.0):
+        self.bind_delay     = bind_delay
+        self.connect_delay  = connect_delay
+        self.search_delay   = search_delay
+
+        #   Entries keyed by dn; values are attribute dictionaries as
+        #   returned by python-ldap.
+        self.entry_dict     = dict()
+
+        #   Copies of entries with lowercase attribute names and values,
+        #   as matched by filters, keyed by dn.
+        self._folded_dict   = dict()
+
+        #   Sets of dns keyed by (name, value) tuples in lowercase.
+        self._index_dict    = dict()
+
+        #   Counters of operations performed, for benchmarks.
+        self.stat_dict      = dict(connect=0, bind=0, search=0)
+
+        self._lock          = threading.Lock()
+        return
+
+    #####
+
+    @classmethod
+    def get(cls, uri):
+        '''Return directory registered for URI.'''
+
+        with cls._directory_dict_lock:
+            if uri not in cls._directory_dict:
+                raise ldap.SERVER_DOWN({ 'desc' : "Can't contact LDAP server",
+                                         'info' : uri })
+
+            return cls._directory_dict[uri]
+
+    #####
+
+    def register(self, uri):
+        '''Serve this directory to FakeLDAPObject instances for URI.'''
+
+        with self._directory_dict_lock:
+            self._directory_dict[uri] = self
+
+        return self
+
+    #####
+
+    def unregister(self, uri):
+        '''Stop serving this directory for URI.'''
+
+        with self._directory_dict_lock:
+            self._directory_dict.pop(uri, None)
+
+        return
+
+    #####
+
+    def add(self, dn, attr_dict):
+        '''Add or replace entry.'''
+
+        folded_dict = dict((k.lower(), [ v.lower() for v in value_list ])
+                                for k, value_list in attr_dict.items())
+
+        with self._lock:
+            self._unindex(dn)
+
+            self.entry_dict[dn] = dict((k, list(v))
+                                        for k, v in attr_dict.items())
+            self._folded_dict[dn] = folded_dict
+
+            for name, value_list in folded_dict.items():
+                for value in value_list:
+                    self._index_dict.setdefault((name, value), set()).add(dn)
+
+        return
+
+    #####
+
+    def _unindex(self, dn):
+        '''Remove existing entry from index; caller must hold lock.'''
+
+        for name, value_list in self._folded_dict.pop(dn, {}).items():
+            for value in value_list:
+                self._index_dict[(name, value)].discard(dn)
+
+        return
+
+    #####
+
+    def count(self, operation):
+        '''Count operation for statistics.'''
+
+        with self._lock:
+            self.stat_dict[operation] += 1
+
+        return
+
+    #####
+
+    def search(self, base_dn, scope, ldap_filter, attr_list=None):
+        '''Return list of (dn, attr_dict) tuples matching search.'''
+
+        predicate   = parse_filter(ldap_filter)
+        base_dn     = base_dn.lower()
+        attr_set    = set(a.lower() for a in attr_list or ())
+
+        result_list = []
+
+        with self._lock:
+            if predicate.key_list is None:
+                dn_list = self.entry_dict.keys()
+
+            else:
+                dn_list = set()
+                for key in predicate.key_list:
+                    dn_list.update(self._index_dict.get(key, ()))
+
+            entry_list = [ (dn, self.entry_dict[dn], self._folded_dict[dn])
+                                for dn in sorted(dn_list) ]
+
+        for dn, attr_dict, folded_dict in entry_list:
+            dn_lower = dn.lower()
+
+            if scope == ldap.SCOPE_BASE:
+                if dn_lower != base_dn:
+                    continue
+
+            elif scope == ldap.SCOPE_ONELEVEL:
+                if dn_lower.partition(',')[2] != base_dn:
+                    continue
+
+            elif dn_lower != base_dn and \
+                    not dn_lower.endswith(',' + base_dn):
+                continue
+
+            if not predicate(folded_dict):
+                continue
+
+            if attr_set:
+                attr_dict = dict((k, v) for k, v in attr_dict.items()
+                                    if k.lower() in attr_set)
+
+            result_list.append((dn, dict((k, list(v))
+                                         for k, v in attr_dict.items())))
+
+        return result_list
+
+    #####
+
+    def seed_campus(self, count, base_dn='ou=people,dc=uiuc,dc=edu'):
+        '''
+        Add count synthetic Campus LDAP person entries beneath base_dn.
+        Entry i has netid 'user%06d', UIN '65%07d' and a registry unique
+        ID derived from its netid.
+        '''
+
+        type_list = [ 'Student', 'Staff', 'Faculty', 'Affiliate' ]
+
+        for i in range(count):
+            netid = 'user%06d' % i
+
+            self.add('uid=%s,%s' % (netid, base_dn),
+                     {
+                     'objectClass'          : [ 'top', 'person',
+                                                'uiucEduPerson' ],
+                     'cn'                   : [ 'User %d' % i ],
+                     'givenName'            : [ 'User' ],
+                     'sn'                   : [ str(i) ],
+                     'mail'                 : [ '%s@illinois.edu' % netid ],
+                     'uiucEduNetID'         : [ netid ],
+                     'uiucEduUIN'           : [ '65%07d' % i ],
+                     'uiucEduRegistryUniqueID' :
+                        [ hashlib.md5(netid).hexdigest().upper() ],
+                     'uiucEduType'          : [ type_list[i % len(type_list)] ],
+                     })
+
+        return self
+
+#####
+
+class FakeLDAPObject(object):
+    '''
+    Stand-in for ldap.ldapobject.LDAPObject backed by the FakeDirectory
+    registered for its URI.
+    '''
+
+    #   Message IDs for asynchronous searches.
+    _msgid_counter  = itertools.count(1)
+
+    #####
+
+    #   pylint: disable=W0613
+    def __init__(self, uri, **kw_arg_dict):
+        self.directory  = FakeDirectory.get(uri)
+        self.uri        = uri
+
+        self.bind_dn    = None
+        self.option_dict = dict()
+
+        #   Pending asynchronous searches keyed by message ID; values are
+        #   lists of remaining entries and response controls.
+        self._pending_dict = dict()
+
+        self.directory.count('connect')
+        time.sleep(self.directory.connect_delay)
+        return
+
+    #####
+
+    def abandon(self, msgid):
+        '''Abandon asynchronous search.'''
+
+        self._pending_dict.pop(msgid, None)
+        return
+
+    #####
+
+    def get_option(self, option):
+        '''Return option set on this connection.'''
+        return self.option_dict.get(option)
+
+    #####
+
+    def result3(self, msgid, all=1, timeout=None):
+        '''
+        Return results of asynchronous search as a 4-tuple of result type,
+        result data, message ID and server controls.
+        '''
+
+        #   pylint: disable=W0622,W0613
+        if msgid not in self._pending_dict:
+            raise ldap.NO_SUCH_OPERATION({ 'desc' : 'unknown msgid' })
+
+        entry_list, control_list = self._pending_dict[msgid]
+
+        if all:
+            del self._pending_dict[msgid]
+            return ldap.RES_SEARCH_RESULT, entry_list, msgid, control_list
+
+        if entry_list:
+            return ldap.RES_SEARCH_ENTRY, [ entry_list.pop(0) ], msgid, []
+
+        del self._pending_dict[msgid]
+        return ldap.RES_SEARCH_RESULT, [], msgid, control_list
+
+    #####
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)',
+                   attrlist=None, attrsonly=0, serverctrls=None, **kw_arg_dict):
+        '''Begin asynchronous search; returns message ID.'''
+
+        #   pylint: disable=W0613
+        entry_list = self.search_s(base, scope, filterstr, attrlist=attrlist)
+        control_list = []
+
+        #   Honor Simple Paged Results control; the cookie is simply the
+        #   offset of the next page.
+        for control in serverctrls or ():
+            if control.controlType != SimplePagedResultsControl.controlType:
+                continue
+
+            offset = int(control.cookie or 0)
+            end = offset + control.size
+
+            cookie = str(end) if end < len(entry_list) else ''
+            entry_list = entry_list[offset:end]
+
+            control_list.append(SimplePagedResultsControl
+                                    (True, size=control.size, cookie=cookie))
+
+        msgid = self._msgid_counter.next()
+        self._pending_dict[msgid] = (entry_list, control_list)
+        return msgid
+
+    #####
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)',
+                 attrlist=None, attrsonly=0):
+        '''Perform synchronous search.'''
+
+        #   pylint: disable=W0613
+        self.directory.count('search')
+        time.sleep(self.directory.search_delay)
+
+        return self.directory.search(base, scope, filterstr, attrlist)
+
+    #####
+
+    def set_option(self, option, value):
+        '''Set option on this connection.'''
+
+        self.option_dict[option] = value
+        return
+
+    #####
+
+    def simple_bind_s(self, who='', cred=''):
+        '''Bind connection; any credentials are accepted.'''
+
+        #   pylint: disable=W0613
+        self.directory.count('bind')
+        time.sleep(self.directory.bind_delay)
+
+        self.bind_dn = who
+        return
+
+    #####
+
+    def unbind_s(self):
+        '''Unbind connection.'''
+
+        self.bind_dn = None
+        return
+
+    #####
+
+    def whoami_s(self):
+        '''Return authorization identity.'''
+        return 'dn:%s' % self.bind_dn if self.bind_dn else ''
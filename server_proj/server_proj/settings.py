@@ -164,6 +164,7 @@ INSTALLED_APPS = (
     'spotseeker_server',
     'oauth_provider',
     'uiuc_admin',
+    'uiuc_api',
     'uiuc_shib',
     'geoposition',
 )
@@ -19,6 +19,7 @@ urlpatterns = patterns('',
 
     # Uncomment the next line to enable the admin:
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^api/uiuc/', include('uiuc_api.urls')),
     url(r'^api/', include('spotseeker_server.urls')),
 )
 
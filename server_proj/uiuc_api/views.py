@@ -0,0 +1,114 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import json
+from datetime import datetime
+
+from django.db.models import Count, Max
+from django.http import HttpResponse, HttpResponseBadRequest
+
+from spotseeker_server.models import Spot
+from spotseeker_server.require_auth import app_auth_required
+from spotseeker_server.views.rest_dispatch import RESTDispatch
+
+# Format of server_last_modified, as the web tier parses it.
+LAST_MODIFIED_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 5000
+
+
+def _json_response(data):
+    return HttpResponse(json.dumps(data), content_type='application/json')
+
+
+def _spot_summary(spot):
+    """
+    The fields of a spot needed to list it (for example in a sitemap),
+    without the extended info, hours and other details of the full spot
+    JSON.
+    """
+    return {
+        'id': spot.pk,
+        'name': spot.name,
+        'server_last_modified': spot.last_modified.strftime(LAST_MODIFIED_FORMAT),
+        'images': [{'id': image.pk} for image in spot.spotimage_set.all()],
+    }
+
+
+class SpotPageView(RESTDispatch):
+    """
+    Returns one page of spot summaries, ordered by ID, along with the
+    total number of spots:
+
+        GET /api/uiuc/v1/spot/page?offset=0&limit=1000
+
+    A limit of 0 returns just the count. With modified_since (in the
+    server_last_modified format), only spots modified at or after that
+    time are returned and counted, so clients can fetch changes only.
+    """
+    @app_auth_required
+    def GET(self, request):
+        try:
+            offset = max(int(request.GET.get('offset', 0)), 0)
+            limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        except ValueError:
+            return HttpResponseBadRequest("offset and limit must be integers")
+        limit = max(limit, 0)
+
+        spots = Spot.objects.order_by('pk')
+
+        if 'modified_since' in request.GET:
+            try:
+                modified_since = datetime.strptime(request.GET['modified_since'], LAST_MODIFIED_FORMAT)
+            except ValueError:
+                return HttpResponseBadRequest("modified_since must be formatted as %s" % LAST_MODIFIED_FORMAT)
+            spots = spots.filter(last_modified__gte=modified_since)
+
+        if limit:
+            page = spots[offset:offset + limit].prefetch_related('spotimage_set')
+        else:
+            page = []
+
+        return _json_response({
+            'count': spots.count(),
+            'offset': offset,
+            'spots': [_spot_summary(spot) for spot in page],
+        })
+
+
+class SpotCatalogInfoView(RESTDispatch):
+    """
+    Returns a cheap summary of the whole spot catalog, from which clients
+    can tell whether anything changed without fetching any spots:
+
+        GET /api/uiuc/v1/spot/info
+
+    The summary is the number of spots, the largest spot ID and the
+    latest server_last_modified.
+    """
+    @app_auth_required
+    def GET(self, request):
+        info = Spot.objects.aggregate(
+            count=Count('pk'),
+            max_id=Max('pk'),
+            last_modified=Max('last_modified'),
+        )
+
+        last_modified = info['last_modified']
+        return _json_response({
+            'count': info['count'],
+            'max_id': info['max_id'],
+            'server_last_modified': last_modified.strftime(LAST_MODIFIED_FORMAT) if last_modified else None,
+        })
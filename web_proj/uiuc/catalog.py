@@ -0,0 +1,332 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from .spots import SpotList, SpotRecord, get_catalog_info
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'uiuc:spot-catalog:version'
+COUNTER_KEY = 'uiuc:spot-catalog:counter'
+SNAPSHOT_KEY = 'uiuc:spot-catalog:%d'
+CHUNK_KEY = 'uiuc:spot-catalog:%d:%d'
+
+# Attempts at claiming a snapshot version not already in use.
+VERSION_ATTEMPTS = 5
+
+
+def catalog_enabled():
+    return getattr(settings, 'UIUC_SPOT_CATALOG', False)
+
+
+def _cache():
+    return get_cache(getattr(settings, 'UIUC_SPOT_CATALOG_CACHE', 'default'))
+
+
+def _timeout():
+    return getattr(settings, 'UIUC_SPOT_CATALOG_TIMEOUT', 24 * 60 * 60)
+
+
+def _chunk_timeout():
+    # Chunks outlive the header, so an unchanged snapshot can be kept
+    # alive by resetting just the header and version key.
+    return 2 * _timeout()
+
+
+def _max_age():
+    return getattr(settings, 'UIUC_SPOT_CATALOG_MAX_AGE', 5 * 60)
+
+
+def _chunk_size():
+    return getattr(settings, 'UIUC_SPOT_CATALOG_CHUNK', 500)
+
+
+class SpotCatalog(object):
+    """
+    A versioned snapshot of every spot summary, shared between processes
+    through a Django cache backend. Readers check only the (small)
+    version key and keep the snapshot for that version in memory;
+    refresh() fetches the spots modified since the snapshot was built
+    and publishes a new version if anything changed.
+
+    A snapshot is a dict with its 'version', the catalog 'info' from
+    the server (see get_catalog_info) and the 'spots', ordered by ID.
+    In the cache, the spots are split into chunks of
+    UIUC_SPOT_CATALOG_CHUNK, to keep each item under the backend's size
+    limit (1MB for memcached). Chunks are cached for twice as long as
+    the header describing them, and rewritten only once they are older
+    than the header's timeout.
+
+    If the cache has no snapshot (it was evicted, or the backend is
+    DummyCache), the snapshot this process last built or loaded is used
+    until it is UIUC_SPOT_CATALOG_MAX_AGE seconds old, and then brought
+    up to date from the server.
+    """
+    _lock = threading.Lock()
+    _local = None
+    _local_time = None
+    _local_records = None
+
+    def get(self):
+        """
+        The current snapshot, building it first if there is none.
+        """
+        cache = _cache()
+        version = cache.get(VERSION_KEY)
+
+        local = self.__class__._local
+        if version is not None and local is not None and local['version'] == version:
+            return local
+
+        snapshot = None
+        if version is not None:
+            snapshot = self._load(cache, version)
+        if snapshot is None:
+            if self._local_is_fresh():
+                return local
+            snapshot = self.refresh()
+
+        self._set_local(snapshot)
+        return snapshot
+
+    def get_records(self):
+        """
+        The spots of the current snapshot as SpotRecords, converted once
+        per snapshot.
+        """
+        snapshot = self.get()
+        key = (snapshot['version'], snapshot['built'])
+
+        local_records = self.__class__._local_records
+        if local_records is None or local_records[0] != key:
+            local_records = (key, [SpotRecord.from_summary(spot) for spot in snapshot['spots']])
+            self.__class__._local_records = local_records
+        return local_records[1]
+
+    def refresh(self):
+        """
+        Bring the shared snapshot up to date and return it. Spots
+        modified since the last snapshot (the cached one, or else this
+        process's own) are merged into it; if the result disagrees with
+        the server's count or largest ID (because spots were deleted,
+        say) the whole catalog is fetched instead.
+        """
+        with self._lock:
+            cache = _cache()
+            version = cache.get(VERSION_KEY)
+            cached = self._load(cache, version) if version is not None else None
+            old = cached if cached is not None else self.__class__._local
+
+            info = get_catalog_info()
+            if old is not None and old['info'] == info:
+                # Nothing changed; just keep the entries from expiring,
+                # or put them back if they were lost.
+                if old['version'] == version:
+                    chunks = cached is None or time.time() - old['stored'] >= _timeout()
+                    self._store(cache, old, chunks)
+                    self._set_local(old)
+                    return old
+                return self._publish(cache, old['info'], old['spots'])
+
+            spots = None
+            if old is not None and old['info']['server_last_modified']:
+                changed = SpotList(modified_since=old['info']['server_last_modified'])
+                by_id = dict((spot['id'], spot) for spot in old['spots'])
+                for spot in changed[0:changed.count()]:
+                    by_id[spot['id']] = spot
+
+                spots = [by_id[spot_id] for spot_id in sorted(by_id)]
+                if len(spots) != info['count'] or (spots and spots[-1]['id'] != info['max_id']):
+                    spots = None
+
+            if spots is None:
+                all_spots = SpotList()
+                spots = all_spots[0:all_spots.count()]
+
+            return self._publish(cache, info, spots)
+
+    def _publish(self, cache, info, spots):
+        """
+        Store a new snapshot under a version no other process is using,
+        then point the version key at it.
+        """
+        snapshot = {
+            'version': None,
+            'built': datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            'stored': time.time(),
+            'info': info,
+            'spots': spots,
+        }
+        header = self._header(snapshot)
+
+        # Seed the counter (if it's new or was evicted) past the version
+        # in use, and claim each version by adding its header, so racing
+        # processes never write over each other's snapshots.
+        cache.add(COUNTER_KEY, cache.get(VERSION_KEY) or 0, _timeout())
+        for attempt in range(VERSION_ATTEMPTS):
+            try:
+                version = cache.incr(COUNTER_KEY)
+            except ValueError:
+                # The counter is gone again, or the backend doesn't keep
+                # anything (DummyCache).
+                local = self.__class__._local
+                version = (local and local['version'] or 0) + 1
+
+            header['version'] = version
+            if cache.add(SNAPSHOT_KEY % version, header, _timeout()):
+                break
+        else:
+            logger.warning("No free spot catalog version after %d attempts; not sharing the snapshot",
+                           VERSION_ATTEMPTS)
+            snapshot['version'] = version
+            self._set_local(snapshot)
+            return snapshot
+
+        snapshot['version'] = version
+        cache.set_many(self._chunks(snapshot), _chunk_timeout())
+        cache.set(VERSION_KEY, version, _timeout())
+        self._set_local(snapshot)
+        return snapshot
+
+    def _store(self, cache, snapshot, chunks=True):
+        """
+        Write an already published snapshot again, resetting its timeout.
+        Unless chunks is true, only the header and version key are
+        written.
+        """
+        if chunks:
+            snapshot['stored'] = time.time()
+            cache.set_many(self._chunks(snapshot), _chunk_timeout())
+        cache.set_many({
+            SNAPSHOT_KEY % snapshot['version']: self._header(snapshot),
+            VERSION_KEY: snapshot['version'],
+        }, _timeout())
+
+    def _load(self, cache, version):
+        """
+        The snapshot stored under version, or None if it (or any of its
+        chunks) isn't cached.
+        """
+        header = cache.get(SNAPSHOT_KEY % version)
+        if header is None:
+            return None
+
+        keys = [CHUNK_KEY % (version, n) for n in range(header['chunks'])]
+        chunks = cache.get_many(keys)
+        if len(chunks) != len(keys):
+            return None
+
+        spots = []
+        for key in keys:
+            spots.extend(chunks[key])
+
+        return {
+            'version': header['version'],
+            'built': header['built'],
+            # Headers from before chunks outlived them have no 'stored'.
+            'stored': header.get('stored', 0),
+            'info': header['info'],
+            'spots': spots,
+        }
+
+    def _header(self, snapshot):
+        size = _chunk_size()
+        return {
+            'version': snapshot['version'],
+            'built': snapshot['built'],
+            'stored': snapshot['stored'],
+            'info': snapshot['info'],
+            'chunks': (len(snapshot['spots']) + size - 1) // size,
+        }
+
+    def _chunks(self, snapshot):
+        size = _chunk_size()
+        spots = snapshot['spots']
+        return dict((CHUNK_KEY % (snapshot['version'], n), spots[start:start + size])
+                    for n, start in enumerate(range(0, len(spots), size)))
+
+    def _set_local(self, snapshot):
+        self.__class__._local = snapshot
+        self.__class__._local_time = time.time()
+
+    def _local_is_fresh(self):
+        local_time = self.__class__._local_time
+        return (self.__class__._local is not None and local_time is not None and
+                time.time() - local_time < _max_age())
+
+
+class SpotCatalogRefresher(threading.Thread):
+    """
+    Daemon thread that refreshes the spot catalog every interval seconds.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, interval):
+        super(SpotCatalogRefresher, self).__init__(name='SpotCatalogRefresher')
+        self.daemon = True
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    @classmethod
+    def start_once(cls, interval):
+        """
+        Start a single refresher per process; later calls return the
+        refresher already running.
+        """
+        with cls._instance_lock:
+            if cls._instance is None or not cls._instance.is_alive():
+                cls._instance = cls(interval)
+                cls._instance.start()
+        return cls._instance
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                SpotCatalog().refresh()
+            except Exception:
+                logger.exception("Refreshing the spot catalog failed")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _start_refresher():
+    interval = getattr(settings, 'UIUC_SPOT_CATALOG_REFRESH', 0)
+    if interval:
+        SpotCatalogRefresher.start_once(interval)
+
+
+def get_spot_catalog():
+    """
+    The current spot catalog snapshot. Starts the background refresher
+    if UIUC_SPOT_CATALOG_REFRESH (seconds) is set.
+    """
+    _start_refresher()
+    return SpotCatalog().get()
+
+
+def get_spot_records():
+    """
+    The spots of the current catalog snapshot as SpotRecords.
+    """
+    _start_refresher()
+    return SpotCatalog().get_records()
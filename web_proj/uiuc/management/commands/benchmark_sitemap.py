@@ -0,0 +1,173 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import gc
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+
+from uiuc import sitemaps, spots
+from uiuc.sitemaps import SpotSitemap
+from uiuc.spots import LAST_MODIFIED_FORMAT
+
+
+def retained_size(obj):
+    """
+    Bytes held by obj and everything reachable from it through lists,
+    tuples, dicts and slotted objects such as SpotRecord (counting shared
+    objects once), by sys.getsizeof.
+    Unlike the garbage collector's object list, this includes strings.
+    """
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+        else:
+            for name in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, name):
+                    pending.append(getattr(obj, name))
+    return size
+
+
+def _peak_rss():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def synthetic_spots(count, images):
+    """
+    Spot summaries shaped like the server's spot page endpoint returns,
+    with images image IDs each.
+    """
+    start = datetime(2015, 1, 1)
+    return [{
+        'id': spot_id,
+        'name': 'Synthetic Space #%d' % spot_id,
+        'server_last_modified': (start + timedelta(minutes=spot_id)).strftime(LAST_MODIFIED_FORMAT),
+        'images': [{'id': spot_id * 100 + n} for n in range(images)],
+    } for spot_id in range(1, count + 1)]
+
+
+class Command(BaseCommand):
+    help = ("Times sitemap generation against synthetic spots, in place of "
+            "the spot server: SpotSitemap.get_urls, rendering of the "
+            "uiuc/sitemap.xml template and streaming with iter_xml. Reports "
+            "wall time, objects and bytes held by the result, and how far "
+            "each step raised the process's peak RSS.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--spots',
+            dest='spots',
+            default='5000,50000',
+            help='Comma-separated spot counts to benchmark (default: 5000,50000)'),
+        make_option('--images',
+            dest='images',
+            type='int',
+            default=2,
+            help='Images per spot (default: 2)'),
+        make_option('--repeat',
+            dest='repeat',
+            type='int',
+            default=3,
+            help='Runs of each measurement; the fastest is reported (default: 3)'),
+        make_option('--domain',
+            dest='domain',
+            default='example.org',
+            help='Domain of sitemap URLs (default: example.org)'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            counts = [int(count) for count in options['spots'].split(',')]
+        except ValueError:
+            raise CommandError("--spots must be a comma-separated list of integers")
+
+        self.repeat = max(options['repeat'], 1)
+        site = Site(domain=options['domain'], name=options['domain'])
+
+        # Serve every page of spots from memory, bypassing the spot
+        # server and the catalog cache.
+        saved = spots.get_spot_page, sitemaps.catalog_enabled
+        sitemaps.catalog_enabled = lambda: False
+        try:
+            for count in counts:
+                data = synthetic_spots(count, options['images'])
+
+                def get_spot_page(offset, limit, modified_since=None):
+                    return {'count': len(data), 'spots': data[offset:offset + limit]}
+                spots.get_spot_page = get_spot_page
+
+                sitemap = SpotSitemap()
+                sitemap.limit = count
+
+                self.stdout.write("%d spots, %d images each\n" % (count, options['images']))
+                urls = self._measure('get_urls', lambda: sitemap.get_urls(site=site))
+                self._measure('render sitemap.xml',
+                              lambda: render_to_string('uiuc/sitemap.xml', {'urlset': urls}))
+                self._measure('iter_xml',
+                              lambda: ''.join(sitemap.iter_xml(site=site)))
+        finally:
+            spots.get_spot_page, sitemaps.catalog_enabled = saved
+
+    def _measure(self, label, func):
+        """
+        Run func repeat times and report, for the fastest run, its wall
+        time, the objects its result holds on to (the growth in the
+        garbage collector's tracked objects, which leaves out strings),
+        the bytes its result holds on to (see retained_size); and the
+        largest increase in peak RSS over all runs. Peak RSS only grows,
+        so a step shows an increase only if it needs more memory than
+        everything before it.
+        """
+        best = None
+        rss_growth = 0
+        for i in range(self.repeat):
+            result = None
+            gc.collect()
+            objects_before = len(gc.get_objects())
+            rss_before = _peak_rss()
+
+            start = time.time()
+            result = func()
+            elapsed = time.time() - start
+
+            rss_growth = max(rss_growth, _peak_rss() - rss_before)
+            gc.collect()
+            objects = len(gc.get_objects()) - objects_before
+            if best is None or elapsed < best[0]:
+                best = (elapsed, objects, retained_size(result))
+
+        elapsed, objects, retained = best
+        self.stdout.write("  %-20s %8.3fs  %9d objects  %8.1f MB retained  "
+                          "%+8.1f MB peak RSS (%.1f MB)\n" % (
+                              label, elapsed, objects, retained / 1048576.0,
+                              rss_growth / 1048576.0, _peak_rss() / 1048576.0))
+        return result
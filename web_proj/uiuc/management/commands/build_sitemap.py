@@ -0,0 +1,75 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+
+from uiuc.sitemap_files import SitemapBuilder
+
+
+class Command(BaseCommand):
+    help = ("Builds the spot sitemap files served from UIUC_SITEMAP_ROOT, "
+            "re-rendering only spots modified since the last build. With "
+            "--interval, keeps running and rebuilds periodically.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--domain',
+            dest='domain',
+            default=None,
+            help='Domain of sitemap URLs (default: the current Site)'),
+        make_option('--protocol',
+            dest='protocol',
+            default='http',
+            help='Protocol of sitemap URLs (default: http)'),
+        make_option('--processes',
+            dest='processes',
+            type='int',
+            default=None,
+            help='Worker processes to render and write with (default: one per CPU)'),
+        make_option('--interval',
+            dest='interval',
+            type='int',
+            default=0,
+            help='Rebuild every INTERVAL seconds instead of once'),
+    )
+
+    def handle(self, *args, **options):
+        root = getattr(settings, 'UIUC_SITEMAP_ROOT', None)
+        if not root:
+            raise CommandError("UIUC_SITEMAP_ROOT is not set")
+
+        domain = options['domain'] or Site.objects.get_current().domain
+        builder = SitemapBuilder(root, domain, protocol=options['protocol'],
+                                 processes=options['processes'])
+
+        while True:
+            try:
+                stats = builder.build()
+            except Exception as err:
+                if not options['interval']:
+                    raise
+                self.stderr.write("Sitemap build failed: %s\n" % err)
+            else:
+                if int(options['verbosity']) > 0:
+                    self.stdout.write(
+                        "%(spots)d spots, %(rendered)d rendered, "
+                        "%(written)d files written, %(removed)d removed\n" % stats)
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
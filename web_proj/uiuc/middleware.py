@@ -0,0 +1,274 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import gzip
+import hashlib
+import logging
+import threading
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import get_max_age, patch_response_headers, patch_vary_headers
+from django.utils.encoding import iri_to_uri
+from django.utils.text import compress_string
+
+logger = logging.getLogger(__name__)
+
+# Headers that describe one variant of a page rather than the page.
+_VARIANT_HEADERS = ('content-encoding', 'content-length')
+
+
+def device_class(request):
+    """
+    The class of device a page is rendered for, as detected by mobility's
+    DetectMobileMiddleware. Pages are cached per device class rather
+    than per User-Agent.
+    """
+    if getattr(request, 'MOBILE', False):
+        return 'mobile'
+    return 'desktop'
+
+
+def _view_name(view_func):
+    return '%s.%s' % (view_func.__module__, view_func.__name__)
+
+
+def _cache_key(request):
+    # The language LocaleMiddleware chose for the request; by the time
+    # the response is stored, it has deactivated it again.
+    language = getattr(request, 'LANGUAGE_CODE', settings.LANGUAGE_CODE)
+
+    url = hashlib.md5(iri_to_uri(request.build_absolute_uri())).hexdigest()
+    return 'uiuc.page_cache.%s.%s.%s.%s' % (
+        settings.CACHE_MIDDLEWARE_KEY_PREFIX,
+        device_class(request),
+        language,
+        url,
+    )
+
+
+def _is_authenticated(request):
+    """
+    Whether the request is from a logged-in user, going by
+    AuthenticationMiddleware's request.user if it ran, or else the
+    presence of a session cookie.
+    """
+    if hasattr(request, 'user'):
+        return request.user.is_authenticated()
+    return settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+class PageCacheStats(object):
+    """
+    Per-view page cache counts for this process: hits, misses (pages
+    rendered by the view) and stores (pages written to the cache).
+    """
+    _lock = threading.Lock()
+    _stat_dict = {}
+    _requests = 0
+
+    @classmethod
+    def record(cls, view, outcome):
+        with cls._lock:
+            view_dict = cls._stat_dict.setdefault(view, {'hits': 0, 'misses': 0, 'stores': 0})
+            view_dict[outcome] += 1
+
+            if outcome == 'stores':
+                return
+            cls._requests += 1
+            interval = getattr(settings, 'UIUC_PAGE_CACHE_STATS_INTERVAL', 1000)
+            if not interval or cls._requests % interval:
+                return
+
+        cls.log()
+
+    @classmethod
+    def snapshot(cls):
+        """
+        The counts of each view, with the hit rate of its lookups.
+        """
+        with cls._lock:
+            snapshot = dict((view, dict(view_dict)) for view, view_dict in cls._stat_dict.items())
+
+        for view_dict in snapshot.values():
+            lookups = view_dict['hits'] + view_dict['misses']
+            view_dict['hit_rate'] = float(view_dict['hits']) / lookups if lookups else 0.0
+        return snapshot
+
+    @classmethod
+    def log(cls):
+        snapshot = cls.snapshot()
+        hits = sum(view_dict['hits'] for view_dict in snapshot.values())
+        misses = sum(view_dict['misses'] for view_dict in snapshot.values())
+        logger.info("Page cache: %d hits, %d misses (%.1f%% hit rate)",
+                    hits, misses, 100.0 * hits / (hits + misses) if hits + misses else 0.0)
+        for view in sorted(snapshot):
+            logger.info("Page cache: %(view)s: %(hits)d hits, %(misses)d misses, "
+                        "%(stores)d stores (%(percent).1f%% hit rate)",
+                        dict(snapshot[view], view=view, percent=100 * snapshot[view]['hit_rate']))
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._stat_dict = {}
+            cls._requests = 0
+
+
+class UpdatePageCacheMiddleware(object):
+    """
+    Response-phase half of the page cache; a replacement for Django's
+    UpdateCacheMiddleware, and like it must come first in
+    MIDDLEWARE_CLASSES.
+
+    Pages are keyed on URL, language and device class (see device_class)
+    instead of the response's Vary headers, and each is stored with both
+    its plain and its gzipped body, so a hit is served without
+    compressing anything. Only GET requests that got a 200 response
+    without cookies are cached, and not for authenticated users, who
+    are never served from the cache either. Streaming responses (and,
+    before Django 1.5, responses given an iterator) aren't cached.
+
+    Timeouts come from UIUC_PAGE_CACHE_TIMEOUTS, a dict of view paths
+    (e.g. 'uiuc.views.sitemap_file') to seconds, with 0 disabling the
+    cache for a view; otherwise from the response's max-age, and
+    otherwise from UIUC_PAGE_CACHE_SECONDS (by default
+    CACHE_MIDDLEWARE_SECONDS).
+    """
+    def __init__(self):
+        self.cache_timeout = getattr(settings, 'UIUC_PAGE_CACHE_SECONDS', settings.CACHE_MIDDLEWARE_SECONDS)
+        self.view_timeouts = getattr(settings, 'UIUC_PAGE_CACHE_TIMEOUTS', {})
+        self.cache = get_cache(getattr(settings, 'UIUC_PAGE_CACHE_ALIAS', settings.CACHE_MIDDLEWARE_ALIAS))
+
+    def _should_update_cache(self, request, response):
+        if request.method != 'GET' or response.status_code != 200:
+            return False
+        if getattr(response, 'streaming', False) or response.cookies:
+            return False
+        # Reading the content of an iterator response would consume it.
+        if getattr(response, '_base_content_is_iter', False):
+            return False
+        if response.has_header('Content-Encoding') and response['Content-Encoding'] != 'gzip':
+            return False
+
+        # As with CACHE_MIDDLEWARE_ANONYMOUS_ONLY, a response can only
+        # depend on the user if the session was accessed.
+        try:
+            session_accessed = request.session.accessed
+        except AttributeError:
+            session_accessed = False
+        if session_accessed and hasattr(request, 'user') and request.user.is_authenticated():
+            return False
+        return True
+
+    def _get_timeout(self, request, response):
+        view = getattr(request, '_page_cache_view', None)
+        if view in self.view_timeouts:
+            return self.view_timeouts[view]
+
+        timeout = get_max_age(response)
+        if timeout is None:
+            timeout = self.cache_timeout
+        return timeout
+
+    def process_response(self, request, response):
+        if not getattr(request, '_page_cache_update', False):
+            return response
+
+        view = getattr(request, '_page_cache_view', None)
+        PageCacheStats.record(view, 'misses')
+        if not self._should_update_cache(request, response):
+            return response
+
+        timeout = self._get_timeout(request, response)
+        if not timeout:
+            return response
+        patch_response_headers(response, timeout)
+
+        cache_key = _cache_key(request)
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(
+                lambda r: self._store(cache_key, view, r, timeout)
+            )
+        else:
+            self._store(cache_key, view, response, timeout)
+        return response
+
+    def _store(self, cache_key, view, response, timeout):
+        # GZipMiddleware runs first on the way out, so the response may
+        # already be compressed.
+        if response.has_header('Content-Encoding'):
+            gzip_content = response.content
+            content = gzip.GzipFile(fileobj=StringIO(gzip_content)).read()
+        else:
+            content = response.content
+            gzip_content = None
+            if len(content) >= 200:
+                gzip_content = compress_string(content)
+                if len(gzip_content) >= len(content):
+                    gzip_content = None
+
+        self.cache.set(cache_key, {
+            'view': view,
+            'status': response.status_code,
+            'headers': [(key, value) for key, value in response._headers.values()
+                        if key.lower() not in _VARIANT_HEADERS],
+            'content': content,
+            'gzip_content': gzip_content,
+        }, timeout)
+        PageCacheStats.record(view, 'stores')
+
+
+class FetchFromPageCacheMiddleware(object):
+    """
+    Request-phase half of the page cache; a replacement for Django's
+    FetchFromCacheMiddleware, and like it must come last in
+    MIDDLEWARE_CLASSES (after AuthenticationMiddleware, LocaleMiddleware
+    and mobility's DetectMobileMiddleware).
+    """
+    def __init__(self):
+        self.cache = get_cache(getattr(settings, 'UIUC_PAGE_CACHE_ALIAS', settings.CACHE_MIDDLEWARE_ALIAS))
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD') or _is_authenticated(request):
+            request._page_cache_update = False
+            return None
+
+        entry = self.cache.get(_cache_key(request))
+        if entry is None:
+            request._page_cache_update = True
+            return None
+
+        request._page_cache_update = False
+        PageCacheStats.record(entry['view'], 'hits')
+
+        accepts_gzip = re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if accepts_gzip and entry['gzip_content'] is not None:
+            response = HttpResponse(entry['gzip_content'], status=entry['status'])
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(entry['content'], status=entry['status'])
+
+        for key, value in entry['headers']:
+            response[key] = value
+        response['Content-Length'] = str(len(response.content))
+        if entry['gzip_content'] is not None:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._page_cache_view = _view_name(view_func)
+        return None
@@ -0,0 +1,283 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.template.loader import render_to_string
+
+from .sitemaps import URLSET_HEAD, URLSET_TAIL, SpotSitemap
+from .spots import SpotRecord
+
+
+INDEX_NAME = 'sitemap.xml'
+PAGE_NAME = 'sitemap-spots-%d.xml.gz'
+STATE_NAME = 'sitemap-state.json'
+
+# Limits on a single sitemap file (50,000 URLs and 50MB uncompressed,
+# per sitemaps.org); spot and image locations both count as URLs.
+MAX_URLS = getattr(settings, 'UIUC_SITEMAP_MAX_URLS', 50000)
+MAX_BYTES = getattr(settings, 'UIUC_SITEMAP_MAX_BYTES', 50 * 1024 * 1024)
+
+# Spots per rendering task handed to a worker process.
+RENDER_CHUNK = 500
+
+# Bump to discard the fragments of every existing state file.
+STATE_VERSION = 1
+
+# Rendered to fingerprint the URL patterns and templates fragments
+# depend on.
+SAMPLE_SPOT = (1, 'Sample Space #1', '2015-01-01T00:00:00.000000', (2,))
+
+
+def write_file(root, name, data, compress=False):
+    """
+    Write a file atomically, so the view never serves a partial one.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix='.%s.' % name, dir=root)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if compress:
+                # A fixed mtime keeps the output identical for
+                # identical content.
+                with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as gz:
+                    gz.write(data)
+            else:
+                f.write(data)
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, os.path.join(root, name))
+    except:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def _render_chunk(args):
+    """
+    Render the <url> elements of a chunk of spots, given as SpotRecord
+    constructor arguments. Runs in a worker process.
+    """
+    protocol, domain, rows = args
+    sitemap = SpotSitemap()
+
+    fragments = []
+    for row in rows:
+        spot = SpotRecord(*row)
+        url_info = sitemap.get_url_info(spot, protocol, domain)
+        fragments.append(render_to_string('uiuc/sitemap_url.xml', {'url': url_info}).strip())
+    return fragments
+
+
+def _write_shard(args):
+    root, name, data = args
+    write_file(root, name, data, compress=True)
+
+
+class SitemapBuilder(object):
+    """
+    Renders the spot sitemap to files in root: an index (sitemap.xml)
+    and gzipped shards of spots. Shards are cut when the next spot would
+    take one past max_urls URLs or max_bytes bytes, rather than at a
+    fixed number of spots.
+
+    The rendered <url> element of each spot is kept in a state file
+    along with its server_last_modified, so a rebuild renders only spots
+    that changed since the last build (or every spot, if the protocol,
+    domain, URLs or templates changed), and rewrites only shards whose
+    contents changed (leaving the others' modification times, and so
+    their conditional GET validators, alone). Rendering and writing are
+    spread across a pool of worker processes (one per CPU by default;
+    processes=1 does everything in this process).
+    """
+    def __init__(self, root, domain, protocol='http', max_urls=None, max_bytes=None, processes=None):
+        self.root = root
+        self.domain = domain
+        self.protocol = protocol
+        self.max_urls = max_urls or MAX_URLS
+        self.max_bytes = max_bytes or MAX_BYTES
+        self.processes = processes or multiprocessing.cpu_count()
+
+        self.sitemap = SpotSitemap()
+
+    def build(self):
+        """
+        Bring the files in root up to date. Returns a dict of counts of
+        spots, spots rendered, and files written and removed.
+        """
+        state = self._load_state()
+        old_pages = state.get('pages', {})
+
+        fingerprint = self._fingerprint()
+        if state.get('fingerprint') == fingerprint:
+            old_spots = state.get('spots', {})
+        else:
+            old_spots = {}
+
+        items = self.sitemap.items()
+        spots = items[0:len(items)]
+
+        stats = {'spots': len(spots), 'rendered': 0, 'written': 0, 'removed': 0}
+
+        pool = None
+        if self.processes > 1:
+            pool = multiprocessing.Pool(self.processes)
+        map_func = pool.map if pool is not None else map
+
+        try:
+            new_spots = self._render(spots, old_spots, map_func, stats)
+
+            new_pages = {}
+            index = []
+            writes = []
+            for number, shard in enumerate(self._shard(spots, new_spots), 1):
+                name = PAGE_NAME % number
+
+                content = (URLSET_HEAD + ''.join(
+                    new_spots[str(spot.id)][1] + '\n' for spot in shard
+                ) + URLSET_TAIL).encode('utf-8')
+                digest = hashlib.sha1(content).hexdigest()
+
+                if old_pages.get(name) != digest or not os.path.exists(self._path(name)):
+                    writes.append((self.root, name, content))
+                new_pages[name] = digest
+
+                index.append({
+                    'location': self._location(name),
+                    'lastmod': max(self.sitemap.lastmod(spot) for spot in shard),
+                })
+
+            map_func(_write_shard, writes)
+            stats['written'] += len(writes)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        for name in set(old_pages) - set(new_pages):
+            try:
+                os.unlink(self._path(name))
+                stats['removed'] += 1
+            except OSError:
+                pass
+
+        content = render_to_string('uiuc/sitemap_index.xml', {'sitemaps': index})
+        digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        if state.get('index') != digest or not os.path.exists(self._path(INDEX_NAME)):
+            write_file(self.root, INDEX_NAME, content.encode('utf-8'))
+            stats['written'] += 1
+
+        self._save_state({
+            'built': datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            'fingerprint': fingerprint,
+            'spots': new_spots,
+            'pages': new_pages,
+            'index': digest,
+        })
+        return stats
+
+    def _render(self, spots, old_spots, map_func, stats):
+        """
+        The (server_last_modified, fragment) pair of every spot, keyed by
+        ID, reusing fragments of spots unchanged since the last build.
+        """
+        new_spots = {}
+        changed = []
+        for spot in spots:
+            key = str(spot.id)
+            cached = old_spots.get(key)
+            if cached and cached[0] == spot.server_last_modified:
+                new_spots[key] = (cached[0], cached[1])
+            else:
+                changed.append(spot)
+
+        chunks = [changed[start:start + RENDER_CHUNK]
+                  for start in range(0, len(changed), RENDER_CHUNK)]
+        tasks = [(self.protocol, self.domain,
+                  [(spot.id, spot.name, spot.server_last_modified, spot.image_ids) for spot in chunk])
+                 for chunk in chunks]
+
+        for chunk, fragments in zip(chunks, map_func(_render_chunk, tasks)):
+            for spot, fragment in zip(chunk, fragments):
+                new_spots[str(spot.id)] = (spot.server_last_modified, fragment)
+        stats['rendered'] += len(changed)
+
+        return new_spots
+
+    def _shard(self, spots, new_spots):
+        """
+        Split spots into lists that each fit within the URL and byte
+        limits (a spot too large for any shard gets one to itself).
+        """
+        base_bytes = len(URLSET_HEAD) + len(URLSET_TAIL)
+
+        shard = []
+        shard_urls = 0
+        shard_bytes = base_bytes
+        for spot in spots:
+            urls = 1 + len(spot.image_ids)
+            size = len(new_spots[str(spot.id)][1].encode('utf-8')) + 1
+
+            if shard and (shard_urls + urls > self.max_urls or shard_bytes + size > self.max_bytes):
+                yield shard
+                shard = []
+                shard_urls = 0
+                shard_bytes = base_bytes
+
+            shard.append(spot)
+            shard_urls += urls
+            shard_bytes += size
+
+        if shard:
+            yield shard
+
+    def _fingerprint(self):
+        """
+        Identifies everything but the spots that rendered fragments depend
+        on: the state version, protocol and domain, and a sample fragment
+        (which changes with the URL patterns and templates).
+        """
+        sample = _render_chunk((self.protocol, self.domain, [SAMPLE_SPOT]))[0]
+        return hashlib.sha1(repr((
+            STATE_VERSION,
+            self.protocol,
+            self.domain,
+            sample.encode('utf-8'),
+        ))).hexdigest()
+
+    def _location(self, name):
+        return "%s://%s%s" % (
+            self.protocol,
+            self.domain,
+            reverse('uiuc-sitemap-file', kwargs={'name': name}),
+        )
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _load_state(self):
+        try:
+            with open(self._path(STATE_NAME)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        write_file(self.root, STATE_NAME, json.dumps(state))
@@ -12,29 +12,60 @@
     See the License for the specific language governing permissions and
     limitations under the License.
 """
+import hashlib
+import time
 from datetime import datetime
 from django.conf import settings
 from django.contrib.sitemaps import Sitemap
 from django.contrib.sites.models import Site
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
+from django.template import Context
+from django.template.loader import get_template
 
-from spacescout_web.spot import Spot
+from .catalog import catalog_enabled, get_spot_catalog, get_spot_records
+from .spots import SpotList, SpotRecord, get_catalog_info, parse_last_modified
+from .urltemplates import url_template
+
+
+URLSET_HEAD = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"\n'
+               '  xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">\n')
+URLSET_TAIL = '</urlset>\n'
 
 
 class SpotSitemap(Sitemap):
     changefreq = 'monthly'
-
-    def __get(self, name, obj, *args, **kwargs):
-        try:
-            attr = getattr(self, name)
-        except AttributeError:
-            return None
-        if callable(attr):
-            return attr(obj, *args, **kwargs)
-        return attr
+    priority = None
+    # Spots per sitemap page; each page fetches only its own spots.
+    limit = getattr(settings, 'UIUC_SITEMAP_LIMIT', 1000)
 
     def get_urls(self, page=1, site=None, protocol=None):
+        protocol, domain = self._get_protocol_domain(site, protocol)
+
+        return [self.get_url_info(item, protocol, domain)
+                for item in self.paginator.page(page).object_list]
+
+    def iter_xml(self, page=1, site=None, protocol=None):
+        """
+        The sitemap page as an iterator of XML chunks, one per <url>, so
+        it can be streamed rather than rendered whole. The page is looked
+        up (raising EmptyPage or PageNotAnInteger) before returning.
+        """
+        protocol, domain = self._get_protocol_domain(site, protocol)
+        items = self.paginator.page(page).object_list
+
+        return self._iter_xml(items, protocol, domain)
+
+    def _iter_xml(self, items, protocol, domain):
+        template = get_template('uiuc/sitemap_url.xml')
+
+        yield URLSET_HEAD
+        for item in items:
+            url_info = self.get_url_info(item, protocol, domain)
+            yield template.render(Context({'url': url_info})).strip() + '\n'
+        yield URLSET_TAIL
+
+    def _get_protocol_domain(self, site, protocol):
         # Determine protocol
         if self.protocol is not None:
             protocol = self.protocol
@@ -52,54 +83,77 @@ class SpotSitemap(Sitemap):
                 raise ImproperlyConfigured("To use sitemaps, either enable the sites framework or pass a Site/RequestSite object in your view.")
         domain = site.domain
 
-        urls = []
-        for item in self.paginator.page(page).object_list:
-            loc = "%s://%s%s" % (protocol, domain, self.__get('location', item))
-            priority = self.__get('priority', item)
-
-            images = []
-            for image in item.get('images', []):
-                image_loc = "%s://%s%s" % (protocol, domain, self.__get('image_location', item, image))
-                image_info = {
-                    'image': image,
-                    'location': image_loc,
-                    'caption': self.__get('image_caption', item, image),
-                    'title': self.__get('image_title', item, image),
-                }
-                images.append(image_info)
-
-            url_info = {
-                'item':       item,
-                'location':   loc,
-                'lastmod':    self.__get('lastmod', item),
-                'changefreq': self.__get('changefreq', item),
-                'priority':   str(priority is not None and priority or ''),
-                'images':     images,
-            }
-            urls.append(url_info)
-        return urls
+        return protocol, domain
+
+    def get_url_info(self, spot, protocol, domain):
+        """
+        The template context for one <url> element of the sitemap. The
+        sitemap's hooks are called directly, and expect SpotRecords.
+        """
+        prefix = "%s://%s" % (protocol, domain)
+
+        images = [{
+            'image':    image_id,
+            'location': prefix + self.image_location(spot, image_id),
+            'caption':  self.image_caption(spot, image_id),
+            'title':    self.image_title(spot, image_id),
+        } for image_id in spot.image_ids]
+
+        priority = self.priority
+        return {
+            'item':       spot,
+            'location':   prefix + self.location(spot),
+            'lastmod':    self.lastmod(spot),
+            'changefreq': self.changefreq,
+            'priority':   str(priority is not None and priority or ''),
+            'images':     images,
+        }
 
     def items(self):
-        return Spot.get_all()
+        if catalog_enabled():
+            return get_spot_records()
+        return SpotList(factory=SpotRecord.from_summary)
+
+    def get_validators(self):
+        """
+        An (ETag, Last-Modified) pair for the sitemap, derived from a
+        summary of the catalog rather than the spots themselves. The ETag
+        changes whenever a spot is added, changed or removed, or the
+        page size changes; Last-Modified is the latest spot modification
+        as a naive UTC datetime.
+        """
+        if catalog_enabled():
+            info = get_spot_catalog()['info']
+        else:
+            info = get_catalog_info()
+
+        etag = hashlib.sha1('%s:%s:%s:%s' % (
+            info['count'],
+            info['max_id'],
+            info['server_last_modified'],
+            self.limit,
+        )).hexdigest()
+
+        last_modified = None
+        if info['server_last_modified']:
+            local = parse_last_modified(info['server_last_modified'])
+            last_modified = datetime.utcfromtimestamp(time.mktime(local.timetuple()))
+
+        return etag, last_modified
 
     def lastmod(self, spot):
-        return datetime.strptime(spot['server_last_modified'], '%Y-%m-%dT%H:%M:%S.%f')
+        return spot.last_modified
 
     def location(self, spot):
-        return reverse('share-url', kwargs={
-            'spot_id': spot['id'],
-            'spot_name': spot['name'],
-        })
-
-    def image_location(self, spot, image):
-        return reverse('space-image-thumb', kwargs={
-            'spot_id': spot['id'],
-            'image_id': image['id'],
-            'thumb_width': 300,
-        })
-
-    def image_caption(self, spot, image):
-        return spot['name']
-
-    def image_title(self, spot, image):
-        return spot['name']
+        template = url_template('share-url', spot_id=1, spot_name='Sample Space #1')
+        return template.build(spot_id=spot.id, spot_name=spot.name)
+
+    def image_location(self, spot, image_id):
+        template = url_template('space-image-thumb', spot_id=1, image_id=2, thumb_width=300)
+        return template.build(spot_id=spot.id, image_id=image_id, thumb_width=300)
+
+    def image_caption(self, spot, image_id):
+        return spot.name
+
+    def image_title(self, spot, image_id):
+        return spot.name
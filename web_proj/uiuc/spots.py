@@ -0,0 +1,140 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import json
+import oauth2
+from datetime import datetime
+from urllib import urlencode
+
+from django.conf import settings
+
+
+SPOT_INFO_PATH = '/api/uiuc/v1/spot/info'
+SPOT_PAGE_PATH = '/api/uiuc/v1/spot/page'
+
+LAST_MODIFIED_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class SpotServerError(Exception):
+    pass
+
+
+def parse_last_modified(value):
+    return datetime.strptime(value, LAST_MODIFIED_FORMAT)
+
+
+class SpotRecord(object):
+    """
+    A spot summary converted once into a compact record, with its
+    modification time already parsed.
+    """
+    __slots__ = ('id', 'name', 'server_last_modified', 'last_modified', 'image_ids')
+
+    def __init__(self, spot_id, name, server_last_modified, image_ids=()):
+        self.id = spot_id
+        self.name = name
+        self.server_last_modified = server_last_modified
+        self.last_modified = parse_last_modified(server_last_modified)
+        self.image_ids = tuple(image_ids)
+
+    @classmethod
+    def from_summary(cls, summary):
+        return cls(
+            summary['id'],
+            summary['name'],
+            summary['server_last_modified'],
+            [image['id'] for image in summary.get('images', [])],
+        )
+
+
+def _server_get(path, **params):
+    consumer = oauth2.Consumer(key=settings.SS_WEB_OAUTH_KEY, secret=settings.SS_WEB_OAUTH_SECRET)
+    client = oauth2.Client(consumer)
+
+    url = "%s%s?%s" % (settings.SS_WEB_SERVER_HOST, path, urlencode(params))
+    resp, content = client.request(url, 'GET', headers={'Accept': 'application/json'})
+    if resp.status != 200:
+        raise SpotServerError("GET %s returned status %s" % (url, resp.status))
+
+    return json.loads(content)
+
+
+def get_catalog_info():
+    """
+    Fetch a summary of the spot catalog: the 'count' of spots, the
+    largest spot ID ('max_id') and the latest 'server_last_modified'.
+    """
+    return _server_get(SPOT_INFO_PATH)
+
+
+def get_spot_page(offset, limit, modified_since=None):
+    """
+    Fetch spot summaries (id, name, server_last_modified and image IDs)
+    starting at offset, ordered by ID. Returns a dict with the total
+    'count' and the 'spots'. If modified_since (a server_last_modified
+    string) is given, only spots modified since then are included.
+    """
+    params = {'offset': offset, 'limit': limit}
+    if modified_since:
+        params['modified_since'] = modified_since
+    return _server_get(SPOT_PAGE_PATH, **params)
+
+
+class SpotList(object):
+    """
+    A lazy sequence of spot summaries, suitable for a Paginator. Only the
+    count and the slices actually asked for are fetched from the server.
+    If factory is given, each summary is passed through it (for example
+    SpotRecord.from_summary).
+    """
+    def __init__(self, modified_since=None, factory=None):
+        self.modified_since = modified_since
+        self.factory = factory
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = get_spot_page(0, 0, self.modified_since)['count']
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            if key < 0:
+                key += self.count()
+            spots = self[key:key + 1]
+            if not spots:
+                raise IndexError("spot index out of range")
+            return spots[0]
+
+        if key.step not in (None, 1):
+            raise ValueError("SpotList does not support slice steps")
+        start, stop, step = key.indices(self.count())
+
+        # The server caps the page size, so a large slice may take
+        # several requests.
+        spots = []
+        while start < stop:
+            data = get_spot_page(start, stop - start, self.modified_since)
+            if not data['spots']:
+                break
+
+            start += len(data['spots'])
+            if self.factory is not None:
+                spots.extend(self.factory(spot) for spot in data['spots'])
+            else:
+                spots.extend(data['spots'])
+        return spots
@@ -0,0 +1,259 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import gzip
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from django.conf import settings
+from django.conf.urls import patterns, url
+from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from . import sitemaps, spots
+from .middleware import PageCacheStats
+from .spots import LAST_MODIFIED_FORMAT
+from .urltemplates import URLTemplate
+
+
+def _view(request, **kwargs):
+    pass
+
+
+def _page_view(request):
+    if request.user.is_authenticated():
+        who = request.user.username
+    else:
+        who = 'anonymous'
+    return HttpResponse('%s %s %s' % (request.LANGUAGE_CODE, who, 'x' * 500))
+
+
+def _iterator_view(request):
+    return HttpResponse(iter(['<p>', 'x' * 500, '</p>']))
+
+
+# URLs for URLTemplateTest, shaped like the spacescout_web ones the
+# sitemap uses.
+urlpatterns = patterns('',
+    url(r'^space/(?P<spot_id>\d+)/(?P<spot_name>[^/]+)$', _view, name='test-share-url'),
+    url(r'^space/(?P<spot_id>\d+)/image/(?P<image_id>\d+)/thumb/constrain/width:(?P<thumb_width>\d+)$',
+        _view, name='test-image-thumb'),
+    url(r'^search/(?P<query>.+)$', _view, name='test-search'),
+    url(r'^building/(?P<building>[a-z-]+)/(?P<floor>\d{1,6})$', _view, name='test-building'),
+    url(r'^page$', _page_view),
+    url(r'^iterator$', _iterator_view),
+)
+
+
+def _spot_summaries(count):
+    start = datetime(2015, 1, 1)
+    return [{
+        'id': spot_id,
+        'name': 'Space #%d' % spot_id,
+        'server_last_modified': (start + timedelta(days=spot_id)).strftime(LAST_MODIFIED_FORMAT),
+        'images': [{'id': spot_id * 10}],
+    } for spot_id in range(1, count + 1)]
+
+
+class SpotServerTestCase(TestCase):
+    """
+    Serves spots from memory in place of the spot server.
+    """
+    spot_count = 5
+
+    def setUp(self):
+        data = _spot_summaries(self.spot_count)
+
+        def get_spot_page(offset, limit, modified_since=None):
+            return {'count': len(data), 'spots': data[offset:offset + limit]}
+
+        def get_catalog_info():
+            return {
+                'count': len(data),
+                'max_id': data[-1]['id'],
+                'server_last_modified': data[-1]['server_last_modified'],
+            }
+
+        self._saved = spots.get_spot_page, sitemaps.get_catalog_info, sitemaps.catalog_enabled
+        spots.get_spot_page = get_spot_page
+        sitemaps.get_catalog_info = get_catalog_info
+        sitemaps.catalog_enabled = lambda: False
+
+    def tearDown(self):
+        spots.get_spot_page, sitemaps.get_catalog_info, sitemaps.catalog_enabled = self._saved
+
+
+@unittest.skipIf(getattr(settings, 'UIUC_SITEMAP_ROOT', None),
+                 "sitemap sections are served from files")
+@override_settings(MIDDLEWARE_CLASSES=(
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
+))
+class SitemapSectionTest(SpotServerTestCase):
+    def setUp(self):
+        super(SitemapSectionTest, self).setUp()
+        # Spots on the first page.
+        self.url_count = min(self.spot_count, sitemaps.SpotSitemap.limit)
+
+    def get_section(self, **extra):
+        return self.client.get(reverse('uiuc-sitemap-section', kwargs={'section': 'spots'}), **extra)
+
+    def test_identity(self):
+        response = self.get_section()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content.count('<url>'), self.url_count)
+
+    def test_gzip(self):
+        response = self.get_section(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        content = gzip.GzipFile(fileobj=StringIO(response.content)).read()
+        self.assertTrue(content.endswith('</urlset>\n'))
+        self.assertEqual(content.count('<url>'), self.url_count)
+
+    def test_conditional(self):
+        identity = self.get_section()
+        gzipped = self.get_section(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotEqual(identity['ETag'], gzipped['ETag'])
+
+        for response, encoding in ((identity, ''), (gzipped, 'gzip')):
+            not_modified = self.get_section(HTTP_ACCEPT_ENCODING=encoding,
+                                            HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertTrue('Accept-Encoding' in not_modified['Vary'])
+
+        # Each encoding's ETag names only its own body.
+        response = self.get_section(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=identity['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class URLTemplateTest(TestCase):
+    urls = 'uiuc.tests'
+
+    names = [
+        u'Sample Space #1',
+        u'Caf\xe9 Espa\xf1a',
+        u'\u56f3\u66f8\u9928 \u2013 Room 2',
+        u'Room 101 & 102',
+        u'100% Quiet',
+        u'%20 Already Escaped %zz',
+        u'Open? Maybe',
+        u'a=b;c+d',
+    ]
+
+    def test_share_url(self):
+        template = URLTemplate('test-share-url', spot_id=1, spot_name='Sample Space #1')
+        self.assertNotEqual(template.template, None)
+
+        for spot_id, name in enumerate(self.names, 1):
+            kwargs = {'spot_id': spot_id, 'spot_name': name}
+            self.assertEqual(template.build(**kwargs), reverse('test-share-url', kwargs=kwargs))
+
+    def test_image_url(self):
+        template = URLTemplate('test-image-thumb', spot_id=1, image_id=2, thumb_width=300)
+        self.assertNotEqual(template.template, None)
+
+        for spot_id, image_id in ((1, 2), (12345, 678), (9, 90817263)):
+            kwargs = {'spot_id': spot_id, 'image_id': image_id, 'thumb_width': 300}
+            self.assertEqual(template.build(**kwargs), reverse('test-image-thumb', kwargs=kwargs))
+
+    def test_catch_all(self):
+        template = URLTemplate('test-search', query='quiet')
+        self.assertNotEqual(template.template, None)
+
+        for name in self.names + [u'floor/2', u'x%sy', u'%(query)s']:
+            self.assertEqual(template.build(query=name), reverse('test-search', kwargs={'query': name}))
+
+    def test_markers_rejected(self):
+        template = URLTemplate('test-building', building='grainger', floor=2)
+        self.assertEqual(template.template, None)
+
+        for building, floor in (('grainger', 2), ('main-library', 123456)):
+            kwargs = {'building': building, 'floor': floor}
+            self.assertEqual(template.build(**kwargs), reverse('test-building', kwargs=kwargs))
+
+
+@override_settings(
+    MIDDLEWARE_CLASSES=(
+        'uiuc.middleware.UpdatePageCacheMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.middleware.locale.LocaleMiddleware',
+        'django.middleware.gzip.GZipMiddleware',
+        'uiuc.middleware.FetchFromPageCacheMiddleware',
+    ),
+    LANGUAGE_CODE='en-us',
+    LANGUAGES=(('en-us', 'English'), ('de', 'German')),
+    UIUC_PAGE_CACHE_SECONDS=60,
+)
+class PageCacheTest(TestCase):
+    urls = 'uiuc.tests'
+
+    def setUp(self):
+        get_cache(settings.CACHE_MIDDLEWARE_ALIAS).clear()
+        PageCacheStats.reset()
+
+    def get_stats(self, view):
+        return PageCacheStats.snapshot().get('uiuc.tests.%s' % view, {})
+
+    def test_hit(self):
+        first = self.client.get('/page', HTTP_ACCEPT_ENCODING='gzip')
+        second = self.client.get('/page')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertTrue(second.content.startswith('en-us anonymous'))
+        self.assertEqual(self.get_stats('_page_view')['hits'], 1)
+
+    def test_language(self):
+        german = self.client.get('/page', HTTP_ACCEPT_LANGUAGE='de')
+        default = self.client.get('/page')
+        self.assertTrue(german.content.startswith('de '))
+        self.assertTrue(default.content.startswith('en-us '))
+
+        german = self.client.get('/page', HTTP_ACCEPT_LANGUAGE='de')
+        self.assertTrue(german.content.startswith('de '))
+        self.assertEqual(self.get_stats('_page_view')['hits'], 1)
+
+    def test_authenticated(self):
+        self.client.get('/page')
+
+        User.objects.create_user('bob', 'bob@example.com', 'password')
+        self.assertTrue(self.client.login(username='bob', password='password'))
+        response = self.client.get('/page')
+        self.assertTrue(response.content.startswith('en-us bob'))
+
+        self.client.logout()
+        response = self.client.get('/page')
+        self.assertTrue(response.content.startswith('en-us anonymous'))
+
+    # GZipMiddleware itself drains iterators before Django 1.4.2.
+    @override_settings(
+        MIDDLEWARE_CLASSES=(
+            'uiuc.middleware.UpdatePageCacheMiddleware',
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'uiuc.middleware.FetchFromPageCacheMiddleware',
+        ),
+    )
+    def test_iterator(self):
+        for i in range(2):
+            response = self.client.get('/iterator')
+            self.assertEqual(response.content, '<p>%s</p>' % ('x' * 500))
+        self.assertEqual(self.get_stats('_iterator_view')['stores'], 0)
@@ -20,14 +20,31 @@ from django.contrib import admin
 admin.autodiscover()
 
 from .sitemaps import SpotSitemap
-from .views import LoginView, LogoutView
+from .views import LoginView, LogoutView, sitemap_file, sitemap_index, sitemap_section
+
+sitemaps = {
+    'spots': SpotSitemap,
+}
 
 urlpatterns = patterns('',
     url(r'^login$', LoginView.as_view()),
     url(r'^logout$', LogoutView.as_view()),
-
-    url(r'^sitemap.xml$', 'django.contrib.sitemaps.views.sitemap', {
-        'sitemaps': {'spots': SpotSitemap},
-        'template_name': 'uiuc/sitemap.xml',
-    }),
 )
+
+if getattr(settings, 'UIUC_SITEMAP_ROOT', None):
+    # Serve the sitemap files built by the build_sitemap command.
+    urlpatterns += patterns('',
+        url(r'^(?P<name>sitemap[\w.-]*)$', sitemap_file, name='uiuc-sitemap-file'),
+    )
+else:
+    # The index lists one sitemap per section and page; each page is
+    # served as sitemap-<section>.xml?p=<page>.
+    urlpatterns += patterns('',
+        url(r'^sitemap.xml$', sitemap_index, {
+            'sitemaps': sitemaps,
+            'sitemap_url_name': 'uiuc-sitemap-section',
+        }),
+        url(r'^sitemap-(?P<section>.+)\.xml$', sitemap_section, {
+            'sitemaps': sitemaps,
+        }, name='uiuc-sitemap-section'),
+    )
@@ -0,0 +1,77 @@
+""" Copyright 2015 University of Illinois Board of Trustees
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+import logging
+
+from django.core.urlresolvers import NoReverseMatch, reverse
+from django.utils.encoding import force_unicode, iri_to_uri
+
+logger = logging.getLogger(__name__)
+
+# Stand-ins for URL arguments while deriving a template. Digits match the
+# usual patterns (\d+, \w+, [^/]+, .+) and are long enough not to occur
+# elsewhere in a URL.
+_MARKER = '90817263%04d'
+
+_templates = {}
+
+
+class URLTemplate(object):
+    """
+    A named URL pattern reduced once to a format string, so URLs can be
+    built by string formatting instead of a reverse() resolver walk per
+    URL. The template is checked against reverse() for the sample
+    arguments it is derived with; if they disagree, or the pattern won't
+    accept the markers at all, build() falls back to reverse().
+    """
+    def __init__(self, viewname, **sample_kwargs):
+        self.viewname = viewname
+        self.template = None
+
+        markers = dict((name, _MARKER % i)
+                       for i, name in enumerate(sorted(sample_kwargs)))
+        try:
+            template = reverse(viewname, kwargs=markers).replace('%', '%%')
+        except NoReverseMatch:
+            logger.warning("URL pattern for %s does not accept template markers; using reverse()",
+                           viewname)
+            return
+        for name, marker in markers.items():
+            template = template.replace(marker, '%%(%s)s' % name)
+        self.template = template
+
+        expected = reverse(viewname, kwargs=sample_kwargs)
+        if self.build(**sample_kwargs) != expected:
+            logger.warning("URL template %r for %s does not match reverse(); using reverse()",
+                           template, viewname)
+            self.template = None
+
+    def build(self, **kwargs):
+        if self.template is None:
+            return reverse(self.viewname, kwargs=kwargs)
+
+        return iri_to_uri(self.template % dict(
+            (name, force_unicode(value)) for name, value in kwargs.items()
+        ))
+
+
+def url_template(viewname, **sample_kwargs):
+    """
+    The URLTemplate for viewname, derived on first use.
+    """
+    try:
+        return _templates[viewname]
+    except KeyError:
+        template = _templates[viewname] = URLTemplate(viewname, **sample_kwargs)
+        return template
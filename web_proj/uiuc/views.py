@@ -12,14 +12,37 @@
     See the License for the specific language governing permissions and
     limitations under the License.
 """
+import hashlib
+import os
+import re
+import zlib
+from datetime import datetime
+from functools import wraps
+
 from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.contrib.sitemaps import views as sitemaps_views
+from django.contrib.sites.models import get_current_site
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
 from django.views.generic.base import RedirectView
 from django.utils.http import urlquote
 
 from shibboleth.app_settings import LOGOUT_REDIRECT_URL, LOGOUT_SESSION_KEY
 
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Before Django 1.5, middleware such as GZipMiddleware reads the
+    # content of an HttpResponse given an iterator, consuming it, so
+    # responses are rendered whole instead.
+    StreamingHttpResponse = None
+
+_accepts_gzip_re = re.compile(r'\bgzip\b')
+
 class LoginView(RedirectView):
     """
     Redirect the user to the Shibboleth login URL.
@@ -55,3 +78,182 @@ class LogoutView(RedirectView):
             target = self.request.GET.get(REDIRECT_FIELD_NAME, '/')
 
         return settings.SHIBBOLETH_LOGOUT_URL % urlquote(target)
+
+
+def _sitemap_file_stat(name):
+    if not (name.endswith('.xml') or name.endswith('.xml.gz')):
+        return None
+    try:
+        return os.stat(os.path.join(settings.UIUC_SITEMAP_ROOT, name))
+    except OSError:
+        return None
+
+
+def _sitemap_file_etag(request, name):
+    st = _sitemap_file_stat(name)
+    if st is None:
+        return None
+    return '%x-%x' % (int(st.st_mtime), st.st_size)
+
+
+def _sitemap_file_last_modified(request, name):
+    st = _sitemap_file_stat(name)
+    if st is None:
+        return None
+    return datetime.utcfromtimestamp(st.st_mtime)
+
+
+@condition(etag_func=_sitemap_file_etag, last_modified_func=_sitemap_file_last_modified)
+def sitemap_file(request, name):
+    """
+    Serve a sitemap file built by the build_sitemap command, answering
+    conditional requests with 304 Not Modified.
+    """
+    if _sitemap_file_stat(name) is None:
+        raise Http404
+
+    with open(os.path.join(settings.UIUC_SITEMAP_ROOT, name), 'rb') as f:
+        content = f.read()
+
+    if name.endswith('.gz'):
+        content_type = 'application/x-gzip'
+    else:
+        content_type = 'application/xml'
+    return HttpResponse(content, content_type=content_type)
+
+
+def _accepts_gzip(request):
+    return bool(_accepts_gzip_re.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def _encode_chunks(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        yield chunk
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _sitemap_validators(request, sitemaps, section=None):
+    """
+    Combined validators of the sitemaps a request covers, computed once
+    per request. Either is None if any sitemap lacks get_validators().
+    """
+    if not hasattr(request, '_uiuc_sitemap_validators'):
+        if section is not None:
+            sections = [section] if section in sitemaps else []
+        else:
+            sections = sorted(sitemaps)
+
+        etags = []
+        last_modified = None
+        for name in sections:
+            site = sitemaps[name]
+            if callable(site):
+                site = site()
+            if not hasattr(site, 'get_validators'):
+                etags, last_modified = None, None
+                break
+
+            etag, site_last_modified = site.get_validators()
+            etags.append('%s=%s' % (name, etag))
+            if site_last_modified and (last_modified is None or site_last_modified > last_modified):
+                last_modified = site_last_modified
+
+        if etags:
+            etag = hashlib.sha1(' '.join(etags)).hexdigest()
+        else:
+            etag = None
+        request._uiuc_sitemap_validators = (etag, last_modified)
+
+    return request._uiuc_sitemap_validators
+
+
+def _sitemap_etag(request, sitemaps, section=None, **kwargs):
+    return _sitemap_validators(request, sitemaps, section)[0]
+
+
+def _sitemap_gzip_etag(request, sitemaps, section=None, **kwargs):
+    # A strong ETag names one byte representation, so the gzipped body
+    # gets its own.
+    etag = _sitemap_etag(request, sitemaps, section)
+    if etag is not None and _accepts_gzip(request):
+        etag += '-gzip'
+    return etag
+
+
+def _sitemap_last_modified(request, sitemaps, section=None, **kwargs):
+    return _sitemap_validators(request, sitemaps, section)[1]
+
+
+def sitemap_conditional(view, gzip=False):
+    """
+    Wrap a sitemap view so that conditional requests are answered with
+    304 Not Modified from the catalog validators, before any spots are
+    fetched or rendered. Pass gzip=True for a view that gzips its own
+    response for clients that accept it, so the gzipped body gets a
+    distinct ETag.
+    """
+    etag_func = _sitemap_gzip_etag if gzip else _sitemap_etag
+    conditional_view = condition(etag_func=etag_func, last_modified_func=_sitemap_last_modified)(view)
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        # The full response varies on Accept-Encoding, so a 304 must too.
+        if response.status_code == 304:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    return wrapped
+
+
+sitemap_index = sitemap_conditional(sitemaps_views.index)
+
+
+def sitemap_section(request, sitemaps, section):
+    """
+    Stream one page of a sitemap section as it is rendered, compressing
+    it on the fly for clients that accept gzip, so memory use doesn't
+    grow with the size of the page. Without StreamingHttpResponse
+    (before Django 1.5) the page is rendered whole.
+    """
+    if section not in sitemaps:
+        raise Http404("No sitemap available for section: %r" % section)
+    site = sitemaps[section]
+    if callable(site):
+        site = site()
+
+    protocol = 'https' if request.is_secure() else 'http'
+    page = request.GET.get('p', 1)
+    try:
+        chunks = site.iter_xml(page=page, site=get_current_site(request), protocol=protocol)
+    except EmptyPage:
+        raise Http404("Page %s empty" % page)
+    except PageNotAnInteger:
+        raise Http404("No page '%s'" % page)
+
+    chunks = _encode_chunks(chunks)
+    gzipped = _accepts_gzip(request)
+    if gzipped:
+        chunks = _gzip_chunks(chunks)
+
+    if StreamingHttpResponse is not None:
+        response = StreamingHttpResponse(chunks, content_type='application/xml')
+    else:
+        response = HttpResponse(''.join(chunks), content_type='application/xml')
+    if gzipped:
+        # Also keeps GZipMiddleware from compressing it again.
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+sitemap_section = sitemap_conditional(sitemap_section, gzip=True)
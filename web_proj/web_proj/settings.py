@@ -151,7 +151,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 )
 
 MIDDLEWARE_CLASSES = (
-    'django.middleware.cache.UpdateCacheMiddleware',
+    'uiuc.middleware.UpdatePageCacheMiddleware',
     'spacescout_web.middleware.unpatch_vary.UnpatchVaryMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -165,7 +165,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.gzip.GZipMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
+    'uiuc.middleware.FetchFromPageCacheMiddleware',
 )
 
 ROOT_URLCONF = 'web_proj.urls'